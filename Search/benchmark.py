@@ -0,0 +1,276 @@
+"""
+ Benchmarks of the search strategies (N-Puzzle), the local search algorithms (N-Queens) and
+ simulated annealing / genetic algorithm for the TSP (data/ir.csv) on fixed, seeded instances.
+
+     python benchmark.py run -o results.json [--quick] [--warmup 1] [--repeat 3] [-k astar]
+     python benchmark.py compare old.json new.json [--threshold 0.15]
+
+ Every benchmark is run `warmup` times, then timed with `time.perf_counter` `repeat` times (the
+ median is reported) and run once more under `tracemalloc` for its peak memory. The random
+ generators are seeded before every run, so all runs of a benchmark do the same work.
+
+ `compare` exits with status 1 if a benchmark of new.json is slower, uses more memory (by more
+ than `threshold`) or finds a worse solution than in old.json, so it can gate upgrades. Times are
+ compared by their minimum over the repetitions, which is the least noisy, and differences below
+ a millisecond are ignored.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import statistics
+import subprocess
+import tracemalloc
+import numpy as np
+
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'ir.csv')
+
+# hardest 8-puzzle instances (31 moves) for the goal 1 2 3 / 4 5 6 / 7 8 0
+GOAL_8 = (1, 2, 3, 4, 5, 6, 7, 8, 0)
+PUZZLES_8 = {'hard-a': (8, 6, 7, 2, 5, 4, 3, 0, 1),
+             'hard-b': (6, 4, 7, 8, 5, 0, 3, 2, 1)}
+
+# 42-move 15-puzzle instances for the goal 0 1 2 ... 15 (the first is instance 79 of Korf, 1985)
+GOAL_15 = tuple(range(16))
+PUZZLES_15 = {'korf-79': (0, 1, 9, 7, 11, 13, 5, 3, 14, 12, 4, 2, 8, 6, 10, 15),
+              'hard-42': (1, 3, 2, 5, 10, 9, 15, 6, 8, 14, 13, 11, 12, 4, 7, 0)}
+
+
+class Benchmark:
+    ''' A named benchmark. `run()` does the work once and returns (work, quality): the number of
+        generated nodes or iterations, and the cost of the solution found (lower is better).
+    '''
+
+    def __init__(self, name, run, unit, seed=0):
+        self.name, self.unit, self.seed = name, unit, seed
+        self._run = run
+
+    def run(self):
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+        return self._run()
+
+    def measure(self, warmup=1, repeat=3):
+        for _ in range(warmup):
+            self.run()
+
+        times = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            work, quality = self.run()
+            times.append(time.perf_counter() - start_time)
+
+        tracemalloc.start()
+        self.run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        median = statistics.median(times)
+        return {'time': median, 'min_time': min(times), 'times': times, 'unit': self.unit, 'work': work,
+                'rate': work / median if median > 0 else None,
+                'peak_memory': peak_memory, 'quality': quality}
+
+
+def puzzle_benchmarks(quick=False):
+    from npuzzle import NPuzzleState
+    from strategies import BFS, UCS, Greedy, AStar, IDAStar
+    from heuristics import ManhattanDistance, LinearConflict
+
+    def strategy(make, heuristic=None):
+        def run(start, goal):
+            search = make()
+            path = search(start, goal) if heuristic is None else search(start, goal, heuristic(goal))
+            return search.num_generated, len(path)
+        return run
+
+    strategies_8 = {
+        'bfs': strategy(BFS),
+        'bfs-bidirectional': strategy(lambda: BFS(bidirectional=True)),
+        'ucs': strategy(UCS),
+        'ucs-bidirectional': strategy(lambda: UCS(bidirectional=True)),
+        'greedy-manhattan': strategy(Greedy, ManhattanDistance),
+        'astar-manhattan': strategy(AStar, ManhattanDistance),
+        'astar-linear-conflict': strategy(AStar, LinearConflict),
+        'idastar-manhattan': strategy(IDAStar, ManhattanDistance),
+    }
+    strategies_15 = {
+        'astar-linear-conflict': strategy(AStar, LinearConflict),
+        'idastar-manhattan': strategy(IDAStar, ManhattanDistance),
+        'idastar-linear-conflict': strategy(IDAStar, LinearConflict),
+    }
+
+    benchmarks = []
+    for goal, puzzles, strategies in [(GOAL_8, PUZZLES_8, strategies_8), (GOAL_15, PUZZLES_15, strategies_15)]:
+        goal_state = NPuzzleState(tiles=goal)
+        for instance, tiles in list(puzzles.items())[:1 if quick else None]:
+            start_state = NPuzzleState(tiles=tiles)
+            for name, run in strategies.items():
+                benchmarks.append(Benchmark(f'npuzzle-{len(goal) - 1}/{instance}/{name}',
+                                            lambda run=run, s=start_state, g=goal_state: run(s, g), 'nodes'))
+    return benchmarks
+
+
+def nqueens_benchmarks(quick=False):
+    from nqueens import NQueensArrayStatePermutation
+    from local_search import HillClimbing, SimulatedAnnealing, MinConflicts
+
+    def hill_climbing(N):
+        def run():
+            solver = HillClimbing(history='off')
+            state = solver.search(NQueensArrayStatePermutation.random_state(N), vectorized=True)
+            return solver.history.num_iterations, state.conflicts()
+        return run
+
+    def simulated_annealing(N, max_iterations):
+        def run():
+            solver = SimulatedAnnealing(history='off')
+            solver.search(NQueensArrayStatePermutation.random_state(N), T0=1, alpha=0.9999,
+                          max_iterations=max_iterations)
+            return solver.num_iterations, solver.best.conflicts()
+        return run
+
+    def min_conflicts(N):
+        def run():
+            solver = MinConflicts(history='off')
+            state = solver.search(N=N)
+            return solver.num_steps, state.conflicts()
+        return run
+
+    sizes = [8, 100, 1000] if quick else [8, 100, 1000, 10000]
+    benchmarks = []
+    for N in sizes:
+        if N <= (100 if quick else 1000):  # best_neighbor_vectorized evaluates N^2 neighbors per step
+            benchmarks.append(Benchmark(f'nqueens-{N}/hill-climbing', hill_climbing(N), 'iterations'))
+        benchmarks.append(Benchmark(f'nqueens-{N}/simulated-annealing',
+                                    simulated_annealing(N, 20000 if quick else 100000), 'iterations'))
+        benchmarks.append(Benchmark(f'nqueens-{N}/min-conflicts', min_conflicts(N), 'iterations'))
+    return benchmarks
+
+
+def tsp_benchmarks(quick=False):
+    from tsp_utils import parse_cities, distance_matrix, simulated_annealing, Tour
+    from genetic import GeneticAlgorithm, tour_lengths
+
+    cities = parse_cities(DATA)
+    D = distance_matrix(cities)
+
+    def tour_sa():
+        tour = Tour(cities)
+        tour._D = D  # the distance matrix is built once, outside of the timed runs
+        best, lengths = simulated_annealing(tour, T0=10, alpha=0.999 if quick else 0.9999, tol=1e-3)
+        return len(lengths) - 1, best.length()
+
+    def genetic():
+        ga = GeneticAlgorithm(tour_lengths(D), seed=0)
+        ga.search(N=len(D), pop_size=300, max_generations=20 if quick else 100)
+        return len(ga.bests), float(min(ga.bests))
+
+    return [Benchmark('tsp-ir/simulated-annealing', tour_sa, 'iterations'),
+            Benchmark('tsp-ir/genetic-algorithm', genetic, 'generations')]
+
+
+GROUPS = {'npuzzle': puzzle_benchmarks, 'nqueens': nqueens_benchmarks, 'tsp': tsp_benchmarks}
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': commit,
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'processor': platform.processor(),
+            'cpu_count': os.cpu_count()}
+
+
+def run(groups=None, pattern=None, quick=False, warmup=1, repeat=3, verbose=1):
+    ''' Runs the benchmarks of the given groups (all by default) whose name contains pattern '''
+    results = {}
+    for group in groups or GROUPS:
+        for benchmark in GROUPS[group](quick):
+            if pattern and pattern not in benchmark.name:
+                continue
+            results[benchmark.name] = result = benchmark.measure(warmup, repeat)
+            if verbose:
+                rate = f"{result['rate']:,.0f} {result['unit']}/s" if result['rate'] is not None else ''
+                print(f"{benchmark.name:<50} {result['time']:9.4f}s {rate:>24} "
+                      f"{result['peak_memory'] / 2**20:8.1f} MiB  quality {result['quality']:g}", flush=True)
+
+    return {'meta': _metadata(), 'quick': quick, 'warmup': warmup, 'repeat': repeat, 'results': results}
+
+
+def compare(old, new, threshold=0.15, verbose=1):
+    ''' Regressions of new results with respect to old results, as a list of (name, reason) '''
+    regressions = []
+    old_results, new_results = old['results'], new['results']
+    for name in sorted(old_results.keys() - new_results.keys()):
+        regressions.append((name, 'missing'))
+
+    for name in sorted(old_results.keys() & new_results.keys()):
+        o, n = old_results[name], new_results[name]
+        old_time, new_time = o['min_time'], n['min_time']
+        ratio = new_time / old_time if old_time > 0 else 1
+        reasons = []
+        if ratio > 1 + threshold and new_time - old_time > 1e-3:
+            reasons.append(f'time x{ratio:.2f}')
+        if n['peak_memory'] > o['peak_memory'] * (1 + threshold):
+            reasons.append(f"memory x{n['peak_memory'] / max(o['peak_memory'], 1):.2f}")
+        if n['quality'] > o['quality']:
+            reasons.append(f"quality {o['quality']:g} -> {n['quality']:g}")
+        regressions += [(name, reason) for reason in reasons]
+
+        if verbose:
+            print(f"{name:<50} {old_time:9.4f}s {new_time:9.4f}s  x{ratio:5.2f}  "
+                  f"{'REGRESSION: ' + ', '.join(reasons) if reasons else ''}")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the search algorithms')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks and save the results as JSON')
+    run_parser.add_argument('-o', '--output', help='JSON file for the results (default: stdout)')
+    run_parser.add_argument('-g', '--group', action='append', choices=list(GROUPS),
+                            help='benchmark group (default: all groups)')
+    run_parser.add_argument('-k', '--pattern', help='only run benchmarks whose name contains pattern')
+    run_parser.add_argument('--quick', action='store_true', help='fewer and smaller instances')
+    run_parser.add_argument('--warmup', type=int, default=1)
+    run_parser.add_argument('--repeat', type=int, default=3)
+
+    compare_parser = commands.add_parser('compare', help='flag regressions between two result files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.15,
+                                help='allowed relative increase of time and memory (default: 0.15)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        results = run(args.group, args.pattern, args.quick, args.warmup, args.repeat,
+                      verbose=args.output is not None)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=1)
+        else:
+            json.dump(results, sys.stdout, indent=1)
+        return 0
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(old, new, args.threshold)
+    for name, reason in regressions:
+        print(f'Regression: {name}: {reason}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,361 @@
+import os
+import time
+import queue
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+# NumPy is imported by the functions which use it (so importing this module is cheap) and matplotlib
+# by the plot_fitness methods
+
+
+def _tour_lengths(D, population):
+    import numpy as np
+
+    return D[population, np.roll(population, -1, axis=1)].sum(axis=1)
+
+
+def tour_lengths(D):
+    ''' Batched TSP fitness: returns a function which computes the lengths of all tours of a
+        population (one row of city indices per tour) using the distance matrix D.
+        The function can be sent to worker processes (see `IslandModel`).
+    '''
+    import numpy as np
+
+    return partial(_tour_lengths, np.asarray(D))
+
+
+def queens_conflicts(population):
+    ''' Batched N-Queens fitness (permutation formulation): number of pairs of queens on the same
+        diagonal for every row of the population. Gene g in column c is a queen in row g + 1,
+        i.e. `NQueensStatePermutation(queens=list(individual + 1))`.
+    '''
+    import numpy as np
+
+    P, N = population.shape
+    cols = np.arange(N)
+    offsets = (np.arange(P) * 2 * N)[:, None]
+
+    total = np.zeros(P, dtype=np.int64)
+    for diagonals in (population - cols + N, population + cols + 1):
+        counts = np.bincount((diagonals + offsets).ravel(), minlength=2 * N * P).reshape(P, 2 * N)
+        total += (counts * (counts - 1) // 2).sum(axis=1)
+    return total
+
+
+class GeneticAlgorithm:
+    ''' Genetic algorithm over permutations of 0..N-1 (TSP tours, N-Queens permutations).
+
+        The population is a 2-D NumPy array with one individual per row, and every operator
+        works on the whole population at once: fitness, tournament selection, order 1
+        crossover and swap/inversion/scramble mutation. Fitness is minimized.
+    '''
+
+    def __init__(self, fitness, seed=None):
+        ''' fitness: a function which maps a population (P x N array) to P fitness values,
+                     e.g. `tour_lengths(D)` or `queens_conflicts`.
+        '''
+        import numpy as np
+
+        self.fitness = fitness
+        self.rng = np.random.default_rng(seed)
+        self.population, self.scores = None, None
+        self.history, self.bests, self.means = [], [], []
+
+    def random_population(self, pop_size, N):
+        ''' pop_size random permutations of 0..N-1 '''
+        import numpy as np
+
+        return np.argsort(self.rng.random((pop_size, N)), axis=1)
+
+    def tournament_selection(self, n, k=2):
+        ''' Indices of n individuals, each one is the best of k random individuals '''
+        import numpy as np
+
+        samples = self.rng.integers(0, len(self.population), size=(n, k))
+        winners = np.argmin(self.scores[samples], axis=1)
+        return samples[np.arange(n), winners]
+
+    def _order1(self, parents1, parents2, i, j):
+        ''' Children which keep genes [i, j) of parents1 and get the rest in the order of
+            parents2, starting from position j (one cut (i, j) per row).
+        '''
+        import numpy as np
+
+        n, N = parents1.shape
+        rows = np.arange(n)[:, None]
+        t = np.arange(N)
+
+        # position of every gene in parents1, tells which genes are in the kept segment
+        position = np.empty_like(parents1)
+        position[rows, parents1] = t
+
+        # parents2 rotated to start at j, genes of the segment are moved to the end (stable)
+        donor = parents2[rows, (j[:, None] + t) % N]
+        pos = position[rows, donor]
+        in_segment = (pos >= i[:, None]) & (pos < j[:, None])
+        donor = donor[rows, np.argsort(in_segment, axis=1, kind='stable')]
+
+        # fill the N - (j - i) positions j, j + 1, ... (wrapping around) after the segment
+        children = parents1.copy()
+        fill = t < (N - (j - i))[:, None]
+        r, c = np.nonzero(fill)
+        children[r, (j[r] + c) % N] = donor[r, c]
+        return children
+
+    def crossover(self, parents1, parents2):
+        ''' Order 1 crossover of every pair of rows of parents1 and parents2 '''
+        n, N = parents1.shape
+        i = self.rng.integers(0, N - 1, size=n)
+        j = self.rng.integers(i + 1, N)
+        return self._order1(parents1, parents2, i, j), self._order1(parents2, parents1, i, j)
+
+    def mutate(self, population, probs=(0.8, 0.1, 0.1)):
+        ''' Mutates every row of population (in place) with a swap, an inversion or a scramble
+            of a random segment [i, j], chosen with probabilities `probs`.
+        '''
+        import numpy as np
+
+        n, N = population.shape
+        rows = np.arange(n)
+        i = self.rng.integers(0, N - 1, size=n)
+        j = self.rng.integers(i + 1, N)
+        kind = self.rng.choice(3, size=n, p=np.asarray(probs) / sum(probs))
+
+        # swap genes i and j
+        s = kind == 0
+        population[rows[s], i[s]], population[rows[s], j[s]] = population[rows[s], j[s]], population[rows[s], i[s]]
+
+        # inversion and scramble: a new order of the positions of every row
+        t = np.arange(N)
+        inside = (t >= i[:, None]) & (t <= j[:, None])
+        inversion = np.where(inside, i[:, None] + j[:, None] - t, t)
+        scramble = np.argsort(np.where(inside, i[:, None] + self.rng.random((n, N)) * (j - i + 1)[:, None], t), axis=1)
+        order = np.where((kind == 1)[:, None], inversion, scramble)
+
+        m = kind != 0
+        population[m] = population[rows[m][:, None], order[m]]
+        return population
+
+    def start(self, population):
+        ''' Sets the initial population (at least 2 individuals, so parents can be paired)'''
+        import numpy as np
+
+        population = np.asarray(population)
+        if len(population) < 2:
+            raise ValueError(f'A population needs at least 2 individuals, got {len(population)}')
+        self.population = population
+        self.scores = self.fitness(self.population)
+        self._report()
+
+    def _report(self):
+        import numpy as np
+
+        b = np.argmin(self.scores)
+        self.best, self.best_fitness = self.population[b].copy(), self.scores[b].item()
+        self.history.append(self.best)
+        self.bests.append(self.best_fitness)
+        self.means.append(float(self.scores.mean()))
+
+    def elites(self, n):
+        ''' Copies of the n best individuals '''
+        import numpy as np
+
+        return self.population[np.argsort(self.scores, kind='stable')[:n]].copy()
+
+    def migrate(self, individuals):
+        ''' Replaces the worst individuals of the population with the given ones '''
+        import numpy as np
+
+        worst = np.argsort(self.scores, kind='stable')[len(self.population) - len(individuals):]
+        self.population[worst] = individuals
+        self.scores[worst] = self.fitness(individuals)
+
+    def step(self, k=2, pc=0.9, pm=0.8, probs=(0.8, 0.1, 0.1)):
+        ''' Creates the next generation, of the same size as the current one '''
+        import numpy as np
+
+        P = len(self.population)
+        pairs = (P + 1) // 2  # for an odd size, one child of the last pair is dropped
+        parents = self.population[self.tournament_selection(2 * pairs, k)]
+        parents1, parents2 = parents[0::2], parents[1::2]
+
+        # crossover
+        c = self.rng.random(pairs) < pc
+        children1, children2 = parents1.copy(), parents2.copy()
+        children1[c], children2[c] = self.crossover(parents1[c], parents2[c])
+
+        # mutation
+        children = np.concatenate([children1, children2])[:P]
+        m = self.rng.random(len(children)) < pm
+        children[m] = self.mutate(children[m], probs)
+
+        self.population = children
+        self.scores = self.fitness(children)
+        self._report()
+
+    def search(self, N=None, population=None, pop_size=300, max_generations=200, k=None,
+               pc=0.9, pm=0.8, probs=(0.8, 0.1, 0.1), target=None, verbose=0):
+        ''' Runs the GA from `population` (or pop_size random permutations of 0..N-1) and returns
+            the best individual of the last generation. Stops early when the best fitness
+            reaches `target` (e.g. 0 conflicts).
+        '''
+        if population is None:
+            population = self.random_population(pop_size, N)
+        if k is None:
+            k = max(2, int(0.2 * len(population)))
+
+        self.history, self.bests, self.means = [], [], []
+        self.start(population)
+
+        for i in range(1, max_generations + 1):
+            if target is not None and self.best_fitness <= target:
+                break
+
+            self.step(k, pc, pm, probs)
+
+            if verbose:
+                print(f'Generation {i:3d} | best {self.best_fitness:.2f} | mean {self.means[-1]:.2f}', flush=True)
+
+        return self.best
+
+    def __call__(self, *args, **kwargs):
+        return self.search(*args, **kwargs)
+
+    def plot_fitness(self):
+        import matplotlib.pyplot as plt
+        
+        plt.figure(figsize=(12, 6))
+        plt.plot(self.means, label='Average')
+        plt.plot(self.bests, label='Best')
+        plt.xlabel('Generation')
+        plt.ylabel('Fitness')
+        plt.legend(loc='best')
+        plt.show()
+
+
+_stop_event, _ring = None, None
+
+
+def _init_island(stop_event, ring):
+    ''' Initializer of island worker processes: keeps the shared stop flag and migration queues '''
+    global _stop_event, _ring
+    _stop_event, _ring = stop_event, ring
+
+
+def _run_island(island, fitness, population, seed, max_generations, epoch, migrants, target, seconds, kwargs):
+    ''' Evolves one island and sends its elites to the next island every `epoch` generations'''
+    start_time = time.perf_counter()
+    inbox, outbox = _ring[island], _ring[(island + 1) % len(_ring)]
+    for q in _ring:
+        q.cancel_join_thread()  # do not wait for migrants which nobody will receive
+
+    ga = GeneticAlgorithm(fitness, seed)
+    ga.start(population)
+    generation = 0
+
+    while generation < max_generations and not _stop_event.is_set():
+        if target is not None and ga.best_fitness <= target:
+            _stop_event.set()  # tell other islands to stop
+            break
+        if seconds is not None and time.perf_counter() - start_time > seconds:
+            _stop_event.set()
+            break
+
+        ga.step(**kwargs)
+        generation += 1
+
+        # ring migration: send elites to the next island, wait for the elites of the previous one
+        if migrants and generation % epoch == 0 and generation < max_generations:
+            outbox.put(ga.elites(migrants))
+            while not _stop_event.is_set():
+                try:
+                    ga.migrate(inbox.get(timeout=0.05))
+                    break
+                except queue.Empty:
+                    pass
+
+    stats = {'island': island,
+             'seed': seed,
+             'generations': generation,
+             'fitness': ga.best_fitness,
+             'time': time.perf_counter() - start_time}
+    return ga.best, ga.bests, ga.means, stats
+
+
+class IslandModel:
+    ''' Island-model GA: every island is a `GeneticAlgorithm` with its own sub-population in its
+        own process. Every `epoch` generations, each island sends copies of its `migrants` best
+        individuals to the next island in a ring, where they replace the worst individuals.
+        All islands stop when one of them reaches `target`, after `max_generations` generations
+        or after `seconds` seconds.
+
+        `bests[i]` and `means[i]` are the best and mean fitness of island i per generation, 
+        e.g. `tsp_utils.plot_fitness(model.bests[i], model.means[i])`.
+    '''
+
+    def __init__(self, fitness, num_islands=None, seed=0):
+        self.fitness = fitness
+        self.num_islands = num_islands or os.cpu_count()
+        self.seed = seed
+        self.best, self.best_fitness = None, None
+        self.bests, self.means, self.stats = [], [], []
+        self.wall_time = None
+
+    def search(self, N=None, populations=None, pop_size=300, max_generations=200, epoch=10,
+               migrants=5, target=None, seconds=None, **kwargs):
+        ''' Returns the best individual of all islands. `populations` are the initial populations 
+            of the islands (random permutations of 0..N-1 by default), `kwargs` are passed to 
+            `GeneticAlgorithm.step` (k, pc, pm, probs).
+        '''
+        import numpy as np
+
+        start_time = time.perf_counter()
+        if populations is None:
+            rng = GeneticAlgorithm(self.fitness, self.seed)
+            populations = [rng.random_population(pop_size, N) for _ in range(self.num_islands)]
+        populations = [np.asarray(population) for population in populations]
+        if min(map(len, populations)) < 2:
+            raise ValueError(f'A population needs at least 2 individuals, got {min(map(len, populations))}')
+        kwargs.setdefault('k', max(2, int(0.2 * len(populations[0]))))
+
+        stop_event = multiprocessing.Event()
+        ring = [multiprocessing.Queue() for _ in populations]
+        self.bests, self.means, self.stats = [], [], []
+        self.best, self.best_fitness = None, None
+
+        with ProcessPoolExecutor(len(populations), initializer=_init_island, initargs=(stop_event, ring)) as executor:
+            futures = [executor.submit(_run_island, island, self.fitness, population, self.seed + island,
+                                       max_generations, epoch, migrants, target, seconds, kwargs)
+                       for island, population in enumerate(populations)]
+
+            for future in futures:
+                best, bests, means, stats = future.result()
+                self.bests.append(bests)
+                self.means.append(means)
+                self.stats.append(stats)
+                if self.best is None or stats['fitness'] < self.best_fitness:
+                    self.best, self.best_fitness = best, stats['fitness']
+
+        self.wall_time = time.perf_counter() - start_time
+        return self.best
+
+    def __call__(self, *args, **kwargs):
+        return self.search(*args, **kwargs)
+
+    def report(self):
+        for stats in self.stats:
+            print(f"island {stats['island']:2d}: generations = {stats['generations']:5d}, "
+                  f"fitness = {stats['fitness']:.2f}, time = {stats['time']:.3f}s")
+        print(f'Wall time = {self.wall_time:.3f}s')
+
+    def plot_fitness(self):
+        import matplotlib.pyplot as plt
+        
+        plt.figure(figsize=(12, 6))
+        for island, bests in enumerate(self.bests):
+            plt.plot(bests, label=f'Island {island}')
+        plt.xlabel('Generation')
+        plt.ylabel('Fitness')
+        plt.legend(loc='best')
+        plt.show()
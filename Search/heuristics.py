@@ -0,0 +1,374 @@
+"""
+ Heuristics for the N-Puzzle which precompute everything that depends only on the goal state.
+ A heuristic object `h` is a drop-in replacement for heuristic functions: `h(state, goal_state)`.
+ Search algorithms which keep the heuristic value of a node can get the values of its children
+ incrementally with `h.successors(state, value)`, and a search which moves tiles in place can
+ update its value with `h.delta(tiles, tile, src, dst, position)`, where position[t] is the
+ position of tile t (it is only needed by pattern databases, which compute it if not given).
+"""
+
+import os
+import math
+import mmap
+import time
+import zlib
+import tempfile
+from bisect import bisect_left
+
+
+class ManhattanDistance:
+    ''' Sum of Manhattan distances of tiles from their goal positions '''
+
+    def __init__(self, goal_state):
+        self.goal_state = goal_state
+        self.N = N = goal_state.N
+        self.grid_size = gs = goal_state.grid_size
+
+        goal = goal_state.tiles
+        self.goal_row, self.goal_col = [0] * (N + 1), [0] * (N + 1)
+        for i, tile in enumerate(goal):
+            self.goal_row[tile], self.goal_col[tile] = i // gs, i % gs
+
+        # table[i][tile]: distance of tile at position i from its goal position (0 for the blank)
+        self.table = [[0] + [abs(i // gs - self.goal_row[t]) + abs(i % gs - self.goal_col[t])
+                             for t in range(1, N + 1)]
+                      for i in range(N + 1)]
+
+        # position of the blank after each action, relative to its position before
+        self.offsets = {'Left': -1, 'Up': -gs, 'Right': 1, 'Down': gs}
+
+    def __call__(self, state, goal_state=None):
+        return sum(map(list.__getitem__, self.table, state.tiles))
+
+    def delta(self, tiles, tile, src, dst, position=None):
+        ''' Change of the heuristic when `tile` moves from position src to the blank at dst '''
+        return self.table[dst][tile] - self.table[src][tile]
+
+    def successors(self, state, value):
+        ''' Successors of state as (successor, action, cost, heuristic value of successor),
+            where `value` is the heuristic value of state.
+        '''
+        tiles = state.tiles
+        blank = tiles.index(0)
+        result = []
+        for successor, action, cost in state.successors():
+            src = blank + self.offsets[action]
+            result.append((successor, action, cost, value + self.delta(tiles, tiles[src], src, blank)))
+        return result
+
+
+def _num_removed(keys):
+    ''' Minimum number of elements (>= 0) to remove from keys to make them increasing (len - LIS).
+        Negative keys are ignored.
+    '''
+    keys = [k for k in keys if k >= 0]
+    if len(keys) < 2 or keys == sorted(keys):
+        return 0
+    
+    tails = []
+    for k in keys:
+        i = bisect_left(tails, k)
+        if i == len(tails):
+            tails.append(k)
+        else:
+            tails[i] = k
+    return len(keys) - len(tails)
+
+
+class LinearConflict(ManhattanDistance):
+    ''' Manhattan distance plus linear conflicts: when tiles are in their goal row (or column)
+        but in the wrong order, some of them must leave that line and come back, which costs
+        two extra moves for each of them.
+    '''
+
+    def __init__(self, goal_state):
+        super().__init__(goal_state)
+        N, gs = self.N, self.grid_size
+        
+        # row_keys[r][tile]: goal column of tile if its goal row is r, otherwise -1 (same for columns)
+        self.row_keys = [[self.goal_col[t] if t and self.goal_row[t] == r else -1 for t in range(N + 1)]
+                         for r in range(gs)]
+        self.col_keys = [[self.goal_row[t] if t and self.goal_col[t] == c else -1 for t in range(N + 1)]
+                         for c in range(gs)]
+
+    def _row_conflicts(self, tiles, r):
+        gs = self.grid_size
+        return _num_removed(list(map(self.row_keys[r].__getitem__, tiles[r * gs: (r + 1) * gs])))
+
+    def _col_conflicts(self, tiles, c):
+        return _num_removed(list(map(self.col_keys[c].__getitem__, tiles[c::self.grid_size])))
+
+    def conflicts(self, tiles):
+        gs = self.grid_size
+        return (sum(self._row_conflicts(tiles, r) for r in range(gs)) +
+                sum(self._col_conflicts(tiles, c) for c in range(gs)))
+
+    def __call__(self, state, goal_state=None):
+        tiles = state.tiles
+        return sum(map(list.__getitem__, self.table, tiles)) + 2 * self.conflicts(tiles)
+
+    def delta(self, tiles, tile, src, dst, position=None):
+        ''' Change of the heuristic when `tile` moves from position src to the blank at dst.
+            Conflicts can only change in the goal column (horizontal move) or goal row (vertical 
+            move) of the tile, and only if the tile leaves or enters that line.
+        '''
+        gs = self.grid_size
+        delta = self.table[dst][tile] - self.table[src][tile]
+        
+        if src // gs == dst // gs:
+            line = self.goal_col[tile]
+            if line != src % gs and line != dst % gs:
+                return delta
+            line_keys, k = self.col_keys[line], src // gs
+            keys = list(map(line_keys.__getitem__, tiles[line::gs]))
+            entering = line == dst % gs
+        else:
+            line = self.goal_row[tile]
+            if line != src // gs and line != dst // gs:
+                return delta
+            line_keys, k = self.row_keys[line], src % gs
+            keys = list(map(line_keys.__getitem__, tiles[line * gs: (line + 1) * gs]))
+            entering = line == dst // gs
+            
+        before = _num_removed(keys)
+        keys[k] = line_keys[tile] if entering else -1
+        return delta + 2 * (_num_removed(keys) - before)
+
+
+def _multipliers(n, k):
+    ''' Multipliers of the digits of the rank of k positions out of n: m_j = (n-j-1)! / (n-k)! '''
+    m = [1] * k
+    for j in range(k - 2, -1, -1):
+        m[j] = m[j + 1] * (n - j - 1)
+    return m
+
+
+class PatternDatabase:
+    ''' Additive pattern database heuristic. The tiles are split into disjoint patterns (e.g. 6-6-3
+        for the 15-puzzle) and for every placement of the tiles of a pattern the database keeps the 
+        number of moves of those tiles needed to reach their goal positions (moves of other tiles 
+        are free). Since every move moves one tile, the sum over patterns is admissible.
+
+        A database is an array of n! / (n-k)! bytes (n = N + 1 positions, k tiles in the pattern),
+        one per placement, indexed by the rank of the positions of the pattern tiles as a partial
+        permutation (see `_rank`), e.g. 5.5 MiB for a 6-tile pattern of the 15-puzzle. It is built 
+        by a backward breadth-first search from the goal (vectorized with NumPy), saved in 
+        `directory` and memory-mapped by later processes instead of being built again.
+    '''
+
+    def __init__(self, goal_state, patterns=None, directory=None, verbose=0):
+        self.goal_state = goal_state
+        self.N = N = goal_state.N
+        self.grid_size = gs = goal_state.grid_size
+        n = N + 1
+
+        if patterns is None:
+            size = 4 if N <= 8 else 6 if N <= 15 else 5
+            patterns = [tuple(range(i, min(i + size, n))) for i in range(1, n, size)]
+        self.patterns = [tuple(pattern) for pattern in patterns]
+        if sorted(t for pattern in self.patterns for t in pattern) != list(range(1, n)):
+            raise ValueError(f'Patterns must be a partition of tiles 1..{N}')
+
+        # weights[t]: (pattern of tile t, index j of t in its pattern, multiplier of its digit)
+        self._pattern_weights = [list(zip(pattern, _multipliers(n, len(pattern)))) for pattern in self.patterns]
+        self.weights = [None] * n
+        for p, pattern in enumerate(self._pattern_weights):
+            for j, (t, m) in enumerate(pattern):
+                self.weights[t] = (p, j, m)
+        self._below = [(1 << q) - 1 for q in range(n)]  # bits of the positions below q
+
+        self.offsets = {'Left': -1, 'Up': -gs, 'Right': 1, 'Down': gs}
+        self.directory = directory or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pdb')
+        self.databases = [self._load(pattern, verbose) for pattern in self.patterns]
+
+    def _filename(self, pattern):
+        goal = zlib.crc32(bytes(self.goal_state.tiles))
+        return os.path.join(self.directory, f"{self.N}-{goal:08x}-{'_'.join(map(str, pattern))}.pdb")
+
+    def _load(self, pattern, verbose=0):
+        ''' Memory-maps the database of pattern, building and saving it first if needed.
+            A database is written to a temporary file of its own and then renamed, so processes 
+            which build the same database at the same time each replace the file with a complete 
+            copy (the size of the mapped file is checked anyway, in case it was changed otherwise).
+        '''
+        fname = self._filename(pattern)
+        size = math.perm(self.N + 1, len(pattern))
+        for attempt in range(2):
+            if not os.path.exists(fname) or os.path.getsize(fname) != size:
+                start_time = time.perf_counter()
+                database = self._build(pattern)
+                os.makedirs(self.directory, exist_ok=True)
+                fd, tmp_fname = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        database.tofile(f)
+                    os.replace(tmp_fname, fname)
+                except BaseException:
+                    os.remove(tmp_fname)
+                    raise
+                if verbose:
+                    print(f'Built pattern database {pattern} in {time.perf_counter() - start_time:.1f}s')
+
+            with open(fname, 'rb') as f:
+                database = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(database) == size:
+                return database
+            database.close()  # the file was replaced by something else after the check, build it again
+        raise OSError(f'Pattern database {fname} does not have the expected size of {size} bytes')
+
+    def _build(self, pattern, chunk_size=1 << 20):
+        ''' Backward BFS over (positions of pattern tiles, blank position), indexed by the rank of 
+            these k + 1 positions. Moving the blank over a tile outside the pattern costs 0 and over 
+            a pattern tile costs 1.
+
+            Memory: n! / (n-k-1)! bytes for the distances, plus the frontiers (8 bytes per state) and 
+            the temporary arrays of chunks of chunk_size states. A 6-tile pattern of the 15-puzzle
+            needs 55 MiB for the distances and about 330 MiB at peak.
+        '''
+        import numpy as np  # only building a database needs NumPy
+        
+        n, k, gs = self.N + 1, len(pattern), self.grid_size
+        moves = np.full((n, 4), -1, dtype=np.int64)  # new blank positions (-1 if not possible)
+        for b in range(n):
+            for d, (ok, t) in enumerate([(b % gs > 0, b - 1), (b >= gs, b - gs), 
+                                         (b % gs < gs - 1, b + 1), (b + gs < n, b + gs)]):
+                if ok: moves[b, d] = t
+
+        multipliers = _multipliers(n, k + 1)
+        
+        # placements are kept as a list of k + 1 arrays: the positions of every pattern tile and 
+        # of the blank (column-wise, since NumPy reductions over k + 1 columns are slow)
+        def rank(positions):
+            ''' Ranks of placements (see `_rank`)'''
+            ranks = positions[0] * multipliers[0]
+            for j in range(1, k + 1):
+                digit = positions[j].copy()
+                for i in range(j):
+                    digit -= positions[i] < positions[j]
+                ranks += digit * multipliers[j]
+            return ranks
+
+        def unrank(ranks):
+            positions, taken = [], []  # taken: the positions so far, sorted in every row
+            for j in range(k + 1):
+                p = ranks // multipliers[j] % (n - j)
+                for q in taken:  # skip the taken positions up to p (p is the digit-th free one)
+                    p += q <= p
+                positions.append(p)
+                for i, q in enumerate(taken):
+                    taken[i], p = np.minimum(q, p), np.maximum(q, p)
+                taken.append(p)
+            return positions
+
+        goal = self.goal_state.tiles
+        start = rank([np.array([goal.index(t)]) for t in pattern + (0,)])[0]
+
+        dist = np.full(math.perm(n, k + 1), 255, dtype=np.uint8)
+        dist[start] = 0
+        frontier, d = np.array([start], dtype=np.int64), 0
+
+        def successors(states, pattern_moves):
+            positions = unrank(states)
+            tiles, blank = positions[:k], positions[k]
+            result = []
+            for m in range(4):
+                t = moves[blank, m]
+                occupied = sum(q == t for q in tiles) > 0
+                if pattern_moves:  # the tile at t moves to the blank
+                    s = (t >= 0) & occupied
+                    t, b, placed = t[s], blank[s], [q[s] for q in tiles]
+                    result.append(rank([np.where(q == t, b, q) for q in placed] + [t]))
+                else:  # only the blank moves, which is the last digit of the rank
+                    s = (t >= 0) & ~occupied
+                    t, ranks = t[s], states[s]
+                    result.append(ranks - ranks % (n - k) + t - sum(q[s] < t for q in tiles))
+            return np.concatenate(result)
+
+        def visit(states, pattern_moves, value):
+            ''' Unvisited successors of states, marked with value '''
+            new = [states[:0]]
+            for i in range(0, len(states), chunk_size):
+                s = successors(states[i: i + chunk_size], pattern_moves)
+                s = np.unique(s[dist[s] == 255])
+                dist[s] = value
+                new.append(s)
+            return np.concatenate(new)
+
+        while len(frontier):
+            # states reachable with free moves have the same distance
+            level, new = [frontier], frontier
+            while len(new):
+                new = visit(new, False, d)
+                level.append(new)
+
+            frontier = np.concatenate([visit(states, True, d + 1) for states in level])
+            d += 1
+
+        # the blank is the last digit of the rank, and the distance of a placement of the pattern
+        # is the minimum over blank positions
+        return dist.reshape(-1, n - k).min(axis=1)
+
+    def _rank(self, position, p):
+        ''' Index of the placement of pattern p in its database: the positions q_j of its tiles are 
+            digits q_j - #{i < j: q_i < q_j} < n - j of a mixed radix number (a partial permutation 
+            rank).
+        '''
+        rank, taken, below = 0, 0, self._below
+        for t, m in self._pattern_weights[p]:
+            q = position[t]
+            rank += (q - (taken & below[q]).bit_count()) * m
+            taken |= 1 << q
+        return rank
+
+    def _moved_rank(self, tiles, rank, tile, src, dst):
+        ''' Rank of the pattern of tile after it moves from src to the blank at dst, given its rank 
+            before. The digit of tile changes by dst - src, less the tiles of the pattern before it 
+            which are between src and dst, and the digits of the tiles after it which are between 
+            src and dst change by one, so only the moves of the blank up or down need a loop.
+        '''
+        p, j, m = self.weights[tile]
+        rank += (dst - src) * m
+        sign = 1 if dst > src else -1
+        for x in range(min(src, dst) + 1, max(src, dst)):
+            q, i, mi = self.weights[tiles[x]]
+            if q == p:
+                rank += -sign * m if i < j else sign * mi
+        return rank
+
+    def delta(self, tiles, tile, src, dst, position=None):
+        ''' Change of the heuristic when `tile` moves from position src to the blank at dst. Only 
+            the pattern of tile changes. Its index is computed from `position` (position[t] is the 
+            position of tile t) in O(k) if the caller keeps it, instead of scanning tiles, and the 
+            index after the move is updated from it.
+        '''
+        if position is None:
+            position = self._positions(tiles)
+        p = self.weights[tile][0]
+        db = self.databases[p]
+        index = self._rank(position, p)
+        return db[self._moved_rank(tiles, index, tile, src, dst)] - db[index]
+
+    def _positions(self, tiles):
+        return sorted(range(self.N + 1), key=tiles.__getitem__)  # position[t]: position of tile t
+
+    def __call__(self, state, goal_state=None):
+        position = self._positions(state.tiles)
+        return sum(db[self._rank(position, p)] for p, db in enumerate(self.databases))
+
+    def successors(self, state, value):
+        ''' Successors of state as (successor, action, cost, heuristic value of successor),
+            where `value` is the heuristic value of state.
+        '''
+        tiles = state.tiles
+        blank = tiles.index(0)
+        position = self._positions(tiles)
+        indexes = [self._rank(position, p) for p in range(len(self.patterns))]
+        result = []
+        for successor, action, cost in state.successors():
+            src = blank + self.offsets[action]
+            tile = tiles[src]
+            p = self.weights[tile][0]
+            db, index = self.databases[p], indexes[p]
+            result.append((successor, action, cost, 
+                           value - db[index] + db[self._moved_rank(tiles, index, tile, src, blank)]))
+        return result
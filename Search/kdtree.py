@@ -0,0 +1,120 @@
+import heapq
+
+
+class KDTree:
+    ''' A 2-d tree over city coordinates which supports removing points.
+
+        Distances are computed as in `Point2D.distance`, i.e. coordinate differences are scaled
+        by `x_scale` and `y_scale`. The tree is stored implicitly in an array: the node of range
+        [lo, hi) is the point at position mid = (lo + hi) // 2, its children are [lo, mid) and
+        [mid + 1, hi). Every node keeps the number of points not yet removed from its subtree,
+        so empty subtrees are skipped and queries stay fast while points are removed.
+    '''
+
+    def __init__(self, xs, ys, x_scale=94.05163, y_scale=110.89431):
+        self.xs, self.ys = list(map(float, xs)), list(map(float, ys))
+        self.x_scale, self.y_scale = x_scale, y_scale
+        self.N = N = len(self.xs)
+
+        import numpy as np  # only needed to build the tree, queries use lists
+        X, Y = np.array(self.xs), np.array(self.ys)
+        order = np.arange(N)
+        axis = np.zeros(N, dtype=np.int8)
+
+        # split every range at the median of the coordinate with the larger spread
+        stack = [(0, N)]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= 1:
+                continue
+            idx = order[lo: hi]
+            a = 0 if np.ptp(X[idx]) * x_scale >= np.ptp(Y[idx]) * y_scale else 1
+            half = (hi - lo) // 2
+            order[lo: hi] = idx[np.argpartition((X if a == 0 else Y)[idx], half)]
+            axis[lo + half] = a
+            stack += [(lo, lo + half), (lo + half + 1, hi)]
+
+        self.order = order.tolist()
+        self.axis = axis.tolist()
+        self.position = [0] * N  # position of every point in `order`
+        for i, p in enumerate(self.order):
+            self.position[p] = i
+
+        self.alive = [True] * N
+        self.count = [0] * N  # number of alive points in the subtree of every node
+        stack = [(0, N)]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            self.count[mid] = hi - lo
+            stack += [(lo, mid), (mid + 1, hi)]
+
+    @staticmethod
+    def from_cities(cities, x_scale=94.05163, y_scale=110.89431):
+        return KDTree([c.x for c in cities], [c.y for c in cities], x_scale, y_scale)
+
+    def __len__(self):
+        return self.count[self.N // 2] if self.N else 0
+
+    def __contains__(self, p):
+        return self.alive[p]
+
+    def distance(self, p, q):
+        ''' Distance between points p and q '''
+        dx = (self.xs[p] - self.xs[q]) * self.x_scale
+        dy = (self.ys[p] - self.ys[q]) * self.y_scale
+        return (dx * dx + dy * dy) ** 0.5
+
+    def remove(self, p):
+        ''' Removes point p (an index into the coordinates) in O(log N)'''
+        if not self.alive[p]:
+            return
+
+        self.alive[p] = False
+        target = self.position[p]
+        lo, hi = 0, self.N
+        while True:
+            mid = (lo + hi) // 2
+            self.count[mid] -= 1
+            if target == mid:
+                break
+            lo, hi = (lo, mid) if target < mid else (mid + 1, hi)
+
+    def nearest(self, x, y):
+        ''' Index of the nearest point to (x, y) which is not removed (None if there is no point)'''
+        result = self.k_nearest(x, y, 1)
+        return result[0] if result else None
+
+    def k_nearest(self, x, y, k):
+        ''' Indices of the k nearest points to (x, y) which are not removed, nearest first.
+            Ties are broken by the smaller index.
+        '''
+        xs, ys, sx, sy = self.xs, self.ys, self.x_scale, self.y_scale
+        order, axis, count, alive = self.order, self.axis, self.count, self.alive
+        best = []  # max-heap of (-squared distance, -index) of the k best points so far
+
+        def search(lo, hi):
+            mid = (lo + hi) // 2
+            if lo >= hi or count[mid] == 0:
+                return
+
+            p = order[mid]
+            if alive[p]:
+                dx, dy = (x - xs[p]) * sx, (y - ys[p]) * sy
+                item = (-(dx * dx + dy * dy), -p)
+                if len(best) < k:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+
+            diff = (x - xs[p]) * sx if axis[mid] == 0 else (y - ys[p]) * sy
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            search(*near)
+            if len(best) < k or diff * diff <= -best[0][0]:
+                search(*far)
+
+        if k > 0:
+            search(0, self.N)
+        return [-p for _, p in sorted(best, reverse=True)]
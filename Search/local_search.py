@@ -1,82 +1,468 @@
+import os
 import math
+import time
 import random
-import matplotlib.pyplot as plt
+import multiprocessing
+from operator import add
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from nqueens import NQueensState
+from utils import History, stats_hooks
+
+# matplotlib (plot_history) and IPython (verbose searches) are imported on first use, so headless
+# searches run without them
+
+
+def random_argmin(values):
+    ''' Index of a minimum element of a list, ties are broken uniformly at random '''
+
+    min_value = min(values)
+    count = values.count(min_value)
+    
+    # many ties: a few random probes will hit one of them
+    if count * 32 >= len(values):
+        while True:
+            i = random.randrange(len(values))
+            if values[i] == min_value: return i
+
+    # few ties: jump between them with list.index
+    i = -1
+    for _ in range(random.randrange(count) + 1):
+        i = values.index(min_value, i + 1)
+    return i
 
 
 class HillClimbing:
     
-    def __init__(self):
-        self.history = []
+    def __init__(self, history=None, k=100, size=1000, stats=None):
+        ''' history: what to keep of the trajectory, 'full', 'objective', 'every' (every k-th state), 
+                     'last' (last `size` states) or 'off'. See `utils.History`.
+            stats:   a `utils.Stats` which gets the counters of every search and calls its hooks
+        '''
+        self.history = History(history, k, size)
+        self.stats = stats
         
-    def search(self, state, verbose=0):
+    def search(self, state, verbose=0, vectorized=False, stop=None):
+        ''' Moves to the best neighbor until no neighbor is better. `stop` is an optional callable 
+            checked every iteration, the search ends early when it returns True.
+        '''
         current = state
+        self.history.start(verbose)
+        on_expand, on_accept, on_reject = stats_hooks(self.stats)
+        start_time, accepted = time.perf_counter(), 0
         
-        while True:
-            if verbose == 1: print(current)
-            elif verbose == 2: current.plot(show_conflicts=False)
-            elif verbose == 3: current.plot(show_conflicts=True)
-            self.history.append(current)
+        try:
+            while True:
+                if verbose == 1: print(current)
+                elif verbose == 2: current.plot(show_conflicts=False)
+                elif verbose == 3: current.plot(show_conflicts=True)
+                self.history.append(current, current.conflicts())
+                if stop is not None and stop():
+                    break
+                if on_expand is not None: on_expand(current)
 
-            neighbor = current.best_neighbor()
-            if neighbor >= current: return current
-            current = neighbor
+                # the NumPy version scores the whole neighborhood at once (same result)
+                neighbor = current.best_neighbor_vectorized() if vectorized else current.best_neighbor()
+                if neighbor >= current: 
+                    if on_reject is not None: on_reject(neighbor, neighbor.conflicts() - current.conflicts())
+                    break
+                
+                if on_accept is not None: on_accept(neighbor, neighbor.conflicts() - current.conflicts())
+                current = neighbor
+                accepted += 1
+        finally:  # the counters are recorded even if the search is interrupted
+            if self.stats is not None:
+                self.stats.record('search', time.perf_counter() - start_time, iterations=accepted + 1, 
+                                  expanded=accepted + 1, accepted=accepted, rejected=1)
+        return current
     
-    def __call__(self, state, verbose=0):
-        self.search(state, verbose)
+    def __call__(self, state, verbose=0, vectorized=False):
+        return self.search(state, verbose, vectorized)
         
     def plot_history(self):
+        import matplotlib.pyplot as plt
+        
         plt.figure(figsize=(12, 4))
 
-        conflicts = [state.conflicts() for state in self.history]
+        conflicts = self.history.objective or [state.conflicts() for state in self.history]
         plt.plot(range(len(conflicts)), conflicts)
         plt.xlabel('Iteration')
         plt.ylabel('Conflicts')
         plt.show()
 
         
+class GeometricCooling:
+    ''' T <- alpha * T '''
+    
+    def __init__(self, alpha=0.99):
+        self.alpha = alpha
+        
+    def __call__(self, T, iteration, stall):
+        return self.alpha * T
+
+    
+class LinearCooling:
+    ''' T <- T - delta '''
+    
+    def __init__(self, delta=0.001):
+        self.delta = delta
+        
+    def __call__(self, T, iteration, stall):
+        return T - self.delta
+
+    
+class AdaptiveReheating:
+    ''' Geometric cooling, but every `patience` iterations without improving the best state the 
+        temperature is raised to `T_reheat` (by default, half of the initial temperature). After 
+        `max_reheats` reheats without improvement it only cools, so the search still ends.
+    '''
+    
+    def __init__(self, alpha=0.99, patience=1000, T_reheat=None, max_reheats=10):
+        self.alpha = alpha
+        self.patience = patience
+        self.T_reheat = T_reheat
+        self.max_reheats = max_reheats
+        self.T0 = None
+        
+    def __call__(self, T, iteration, stall):
+        if iteration == 0:
+            self.T0 = T
+        if stall > 0 and stall % self.patience == 0 and stall // self.patience <= self.max_reheats:
+            return max(T, self.T_reheat or self.T0 / 2)
+        return self.alpha * T
+
+
+def print_progress(solver, iteration, state):
+    ''' A progress callback for `SimulatedAnnealing` which prints one line '''
+    print(f'Iteration {iteration}, T = {solver.T:.8f}, Conflicts = {state.conflicts():d}', flush=True)
+
+        
 class SimulatedAnnealing:
     
-    def __init__(self):
-        self.history = []
+    def __init__(self, history=None, k=100, size=1000, stats=None):
+        ''' history: what to keep of the trajectory (see `HillClimbing`)
+            stats:   a `utils.Stats` which gets the counters of every search and calls its hooks
+        '''
+        self.history = History(history, k, size)
+        self.stats = stats
         self.T = None
+        self.best = None
+        self.num_iterations = 0
     
-    def search(self, state=None, T0=10, alpha=0.99, tol=1e-8, verbose=0):
+    def search(self, state=None, T0=10, alpha=0.99, tol=1e-8, verbose=0, 
+               schedule=None, max_iterations=None, callback=None, every=1000, seconds=None):
+        ''' Runs until the temperature falls below `tol`, a solution is found or `max_iterations` is reached.
+
+            verbose:  0 no output (headless), 1 print states, 2 plot states, 3 plot states with conflicts
+            schedule: cooling schedule, a callable (T, iteration, stall) -> T where stall is the number of
+                      iterations since the best state was improved. Default is `GeometricCooling(alpha)`.
+            callback: called as callback(solver, iteration, current) every `every` iterations and/or every
+                      `seconds` seconds (e.g. `print_progress`). If it returns True the search stops.
+        '''
+        schedule = schedule or GeometricCooling(alpha)
         self.T = T0
-        current = state
+        current = self.best = state
+        self.history.start(verbose)
 
-        while True:
+        iteration, stall, accepted = 0, 0, 0
+        next_time = time.perf_counter() + seconds if seconds else None
+        on_expand, on_accept, on_reject = stats_hooks(self.stats)
+        start_time = time.perf_counter()
+        if verbose:
+            from IPython.display import clear_output
 
-            clear_output(wait=True)
-            if verbose == 0: print(f'T = {self.T:.8f}, Conflicts = {current.conflicts():d}')
-            elif verbose == 1: print(current)
-            elif verbose == 2: current.plot(show_conflicts=False)
-            elif verbose == 3: current.plot(show_conflicts=True)
+        try:
+            while True:
+            
+                if verbose:
+                    clear_output(wait=True)
+                    if verbose == 1: print(current)
+                    elif verbose == 2: current.plot(show_conflicts=False)
+                    elif verbose == 3: current.plot(show_conflicts=True)
+                
+                if callback is not None:
+                    if (every and iteration % every == 0) or (next_time and time.perf_counter() >= next_time):
+                        if seconds: next_time = time.perf_counter() + seconds
+                        if callback(self, iteration, current) is True:
+                            break
             
-            self.history.append(current)
+                self.history.append(current, current.conflicts(), self.T)
 
-            if self.T < tol or current.conflicts() == 0:
-                return current
+                if self.T < tol or current.conflicts() == 0:
+                    break
+                if max_iterations is not None and iteration >= max_iterations:
+                    break
 
-            neighbor = current.random_neighbor()
-            delta_E = current.conflicts() - neighbor.conflicts()
-            if delta_E >= 0: 
-                current = neighbor
-            elif random.random() < math.exp(delta_E / self.T):
-                current = neighbor
+                if on_expand is not None: on_expand(current)
+                neighbor = current.random_neighbor()
+                delta_E = current.conflicts() - neighbor.conflicts()
+                if delta_E >= 0 or random.random() < math.exp(delta_E / self.T):
+                    if on_accept is not None: on_accept(neighbor, -delta_E)
+                    current = neighbor
+                    accepted += 1
+                elif on_reject is not None:
+                    on_reject(neighbor, -delta_E)
 
-            self.T = alpha * self.T
+                if current.conflicts() < self.best.conflicts():
+                    self.best, stall = current, 0
+                else:
+                    stall += 1
 
+                self.T = schedule(self.T, iteration, stall)
+                iteration += 1
+        finally:
+            self.num_iterations = iteration
+            if self.stats is not None:
+                self.stats.record('search', time.perf_counter() - start_time, iterations=iteration, 
+                                  expanded=iteration, accepted=accepted, rejected=iteration - accepted)
         return current
     
-    def __call__(self, state=None, T0=10, alpha=0.99, tol=1e-8, verbose=0):
-        return self.search(state, T0, alpha, tol, verbose)
+    def __call__(self, state=None, T0=10, alpha=0.99, tol=1e-8, verbose=0, **kwargs):
+        return self.search(state, T0, alpha, tol, verbose, **kwargs)
     
 
     def plot_history(self):
+        import matplotlib.pyplot as plt
+        
         plt.figure(figsize=(12, 4))
 
-        conflicts = [state.conflicts() for state in self.history]
+        conflicts = self.history.objective or [state.conflicts() for state in self.history]
         plt.plot(range(len(conflicts)), conflicts)
         plt.xlabel('Iteration')
         plt.ylabel('Conflicts')
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+
+class MinConflicts:
+    ''' Min-conflicts local search for N-Queens (first formulation).
+
+        In every step a conflicted queen is selected at random and moved to the least-conflicted 
+        row of its column (ties are broken randomly). The number of queens on every row and 
+        diagonal is kept in counters, so a whole column is scored in O(N) without creating states.
+    '''
+    
+    def __init__(self, history='objective'):
+        ''' history: 'objective' or 'off' (the board is changed in place, so no states are kept) '''
+        self.history = History(history)
+        self.num_steps = 0
+
+    @staticmethod
+    def initial_queens(N, tries=50):
+        ''' Greedy initial assignment: each column gets a random free row, preferring rows 
+            with no diagonal conflicts. This leaves only a handful of conflicts even for large N.
+        '''
+        free = list(range(1, N + 1))
+        diag_counts, anti_diag_counts = [0] * (2 * N), [0] * (2 * N)
+        queens = [0] * N
+        
+        for col in range(N):
+            for _ in range(tries):
+                k = int(random.random() * len(free))
+                row = free[k]
+                if diag_counts[row - col + N - 1] == 0 and anti_diag_counts[row + col] == 0:
+                    break
+            free[k] = free[-1]
+            free.pop()
+            queens[col] = row
+            diag_counts[row - col + N - 1] += 1
+            anti_diag_counts[row + col] += 1
+            
+        return queens
+        
+    def search(self, state=None, N=8, max_steps=100000, tries=50, verbose=0, stop=None):
+        ''' Moves conflicted queens until there are no conflicts or `max_steps` moves were made.
+            `stop` is an optional callable checked every step, the search ends early when it returns True.
+        '''
+        queens = list(state.queens) if state is not None else self.initial_queens(N, tries)
+        N = len(queens)
+
+        current = NQueensState(queens=queens)
+        current.conflicts()
+        rows, diags, antis = current.row_counts, current.diag_counts, current.anti_diag_counts
+        queens = current.queens
+        conflicts = current.num_conflicts
+        
+        def is_conflicted(col):
+            row = queens[col]
+            return rows[row] + diags[row - col + N - 1] + antis[row + col] > 3
+
+        def row_partners(row):
+            col = -1
+            for _ in range(rows[row]):
+                col = queens.index(row, col + 1)
+                yield col
+
+        def conflicted_queens():
+            return [col for col, row in enumerate(queens)
+                    if rows[row] + diags[row - col + N - 1] + antis[row + col] > 3]
+
+        conflicted = []
+        self.num_steps = 0
+        self.history.start()
+        self.history.append(None, conflicts)
+        
+        while conflicts > 0 and self.num_steps < max_steps:
+            if stop is not None and stop():
+                break
+            if not conflicted:
+                conflicted = conflicted_queens()
+
+            # select a random conflicted queen
+            k = random.randrange(len(conflicted))
+            col = conflicted[k]
+            conflicted[k] = conflicted[-1]
+            conflicted.pop()
+            if not is_conflicted(col): continue  # fixed by an earlier move
+            
+            self.num_steps += 1
+            
+            # take the queen off the board
+            row = queens[col]
+            rows[row] -= 1
+            diags[row - col + N - 1] -= 1
+            antis[row + col] -= 1
+            conflicts -= rows[row] + diags[row - col + N - 1] + antis[row + col]
+
+            # on large boards a free row is usually found by sampling a few random rows,
+            # which is the same as choosing uniformly among the rows with zero conflicts
+            old_row, min_cost = row, None
+            for _ in range(tries):
+                row = random.randint(1, N)
+                if row != old_row and rows[row] + diags[row - col + N - 1] + antis[row + col] == 0:
+                    min_cost = 0
+                    break
+
+            if min_cost is None:
+                # number of conflicts for every row in this column: costs[r - 1] for row r
+                # (the current row is excluded, so the queen always moves and plateaus can be left)
+                costs = list(map(add, map(add, rows[1:], diags[N - col: 2 * N - col]), antis[col + 1: col + N + 1]))
+                costs[old_row - 1] = 3 * N
+                row = random_argmin(costs) + 1
+                min_cost = costs[row - 1]
+
+            # put it back on the least-conflicted row
+            queens[col] = row
+            rows[row] += 1
+            diags[row - col + N - 1] += 1
+            antis[row + col] += 1
+            conflicts += min_cost
+            if min_cost > 0:
+                if min_cost == rows[row] - 1:
+                    conflicted += row_partners(row)  # conflicts only on its row: cheap to locate
+                else:
+                    conflicted = []  # partners on the diagonals are unknown, rescan the board
+            
+            self.history.append(None, conflicts)
+            if verbose == 1: print(f'Step {self.num_steps}, Conflicts = {conflicts:d}')
+
+        current.num_conflicts = conflicts
+        return current
+    
+    def __call__(self, state=None, N=8, max_steps=100000, tries=50, verbose=0):
+        return self.search(state, N, max_steps, tries, verbose)
+    
+    def plot_history(self):
+        import matplotlib.pyplot as plt
+        
+        plt.figure(figsize=(12, 4))
+        plt.plot(range(len(self.history.objective)), self.history.objective)
+        plt.xlabel('Step')
+        plt.ylabel('Conflicts')
+        plt.show()
+
+
+_stop_event = None
+
+
+def _init_chain(stop_event):
+    ''' Initializer of portfolio worker processes: keeps the shared stop flag '''
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _run_chain(solver_class, state_class, N, seed, max_restarts, kwargs):
+    ''' Runs random restarts of one solver until a solution is found (by any chain)
+        or restarts are exhausted. Returns the best state and statistics of this chain.
+    '''
+    random.seed(seed)
+    start_time = time.perf_counter()
+    best, restarts, iterations = None, 0, 0
+    
+    # a running search also stops when another chain has found a solution
+    if issubclass(solver_class, SimulatedAnnealing):
+        user_callback = kwargs.get('callback')
+        
+        def callback(solver, iteration, current):
+            if _stop_event.is_set():
+                return True
+            return user_callback is not None and user_callback(solver, iteration, current)
+        
+        kwargs = dict(kwargs, callback=callback)
+    else:
+        kwargs = dict(kwargs, stop=_stop_event.is_set)
+    
+    while restarts < max_restarts and not _stop_event.is_set():
+        solver = solver_class(history='off')
+        state = solver.search(state_class.random_state(N), **kwargs)
+        restarts += 1
+        iterations += solver.history.num_iterations
+        
+        if best is None or state.conflicts() < best.conflicts():
+            best = state
+        if best.conflicts() == 0:
+            _stop_event.set()  # tell other chains to stop
+            
+    stats = {'seed': seed, 
+             'restarts': restarts, 
+             'iterations': iterations, 
+             'conflicts': None if best is None else best.conflicts(),
+             'time': time.perf_counter() - start_time}
+    return best, stats
+
+
+class Portfolio:
+    ''' Runs independent chains of a local search algorithm (e.g. `HillClimbing`) in parallel 
+        processes. Each chain does random restarts with its own seed (`seed + chain index`), 
+        and all chains stop as soon as one of them finds a state with zero conflicts.
+    '''
+    
+    def __init__(self, solver_class=HillClimbing, num_chains=None, seed=0):
+        self.solver_class = solver_class
+        self.num_chains = num_chains or os.cpu_count()
+        self.seed = seed
+        self.stats = []
+        self.wall_time = None
+        
+    def search(self, state_class, N=8, max_restarts=100, **kwargs):
+        ''' Returns the best state found by all chains, `kwargs` are passed to the solver'''
+        
+        start_time = time.perf_counter()
+        stop_event = multiprocessing.Event()
+        best, self.stats = None, []
+        
+        with ProcessPoolExecutor(self.num_chains, initializer=_init_chain, initargs=(stop_event,)) as executor:
+            futures = [executor.submit(_run_chain, self.solver_class, state_class, N, 
+                                       self.seed + chain, max_restarts, kwargs)
+                       for chain in range(self.num_chains)]
+            
+            for future in as_completed(futures):
+                state, stats = future.result()
+                self.stats.append(stats)
+                if state is not None and (best is None or state.conflicts() < best.conflicts()):
+                    best = state
+                if best is not None and best.conflicts() == 0:
+                    stop_event.set()
+        
+        self.stats.sort(key=lambda stats: stats['seed'])
+        self.wall_time = time.perf_counter() - start_time
+        return best
+    
+    def __call__(self, state_class, N=8, max_restarts=100, **kwargs):
+        return self.search(state_class, N, max_restarts, **kwargs)
+    
+    def report(self):
+        for stats in self.stats:
+            print(f"seed {stats['seed']:3d}: restarts = {stats['restarts']:4d}, "
+                  f"iterations = {stats['iterations']:7d}, conflicts = {stats['conflicts']}, "
+                  f"time = {stats['time']:.3f}s")
+        print(f'Wall time = {self.wall_time:.3f}s')
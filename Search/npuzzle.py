@@ -1,5 +1,6 @@
 import math
-import matplotlib.pyplot as plt
+
+# matplotlib is imported by `plot` only; searching for solutions does not need it
 
 
 class NPuzzleState:
@@ -54,7 +55,13 @@ class NPuzzleState:
     def is_goal(self, goal_state):
         return self == goal_state
     
+    def key(self):
+        ''' The tiles, as the key of the state for explored sets (see `utils.state_key`)'''
+        return self.tiles
+    
     def plot(self, ax=None, title=None, fs=20):
+        import matplotlib.pyplot as plt
+        
         if ax is None:
             _, ax = plt.subplots(1)
             
@@ -101,4 +108,110 @@ class NPuzzleState:
         return result
     
     def __repr__(self):
-        return f'NPuzzleState(N={self.N}, tiles={self.tiles})'
\ No newline at end of file
+        return f'NPuzzleState(N={self.N}, tiles={self.tiles})'
+
+class _PuzzleLayout:
+    ''' Everything which depends only on the size of the puzzle, shared by all packed states:
+        bits per tile and the moves of the blank from each of its positions.
+    '''
+    
+    _layouts = {}
+    
+    def __init__(self, N):
+        self.N = N
+        self.grid_size = gs = int(math.sqrt(N + 1))
+        self.bits = max(4, N.bit_length())  # 4 bits per tile up to the 15-puzzle
+        self.mask = (1 << self.bits) - 1
+        
+        # moves[blank] = ((action, new blank position, shift of the moved tile), ...)
+        self.moves = []
+        for b in range(N + 1):
+            moves = []
+            if b % gs > 0:      moves.append(('Left', b - 1))
+            if b >= gs:         moves.append(('Up', b - gs))
+            if b % gs < gs - 1: moves.append(('Right', b + 1))
+            if b + gs <= N:     moves.append(('Down', b + gs))
+            self.moves.append(tuple((action, t, t * self.bits) for action, t in moves))
+            
+    @staticmethod
+    def get(N):
+        if N not in _PuzzleLayout._layouts:
+            _PuzzleLayout._layouts[N] = _PuzzleLayout(N)
+        return _PuzzleLayout._layouts[N]
+    
+    
+class NPuzzlePackedState:
+    ''' Compact N-Puzzle state: the tiles are packed in one integer (`bits` bits per tile, 4 for the 
+        15-puzzle, tile i at bits [i * bits, (i + 1) * bits)) and the blank position is cached. 
+        Successors come from precomputed move tables, and hashing and equality are integer operations.
+        It has the same interface as `NPuzzleState`.
+    '''
+    
+    __slots__ = ('code', 'blank', 'layout')
+    
+    def __init__(self, N=8, tiles=None):
+        if tiles is None:
+            tiles = range(N + 1)
+        
+        self.layout = layout = _PuzzleLayout.get(len(tiles) - 1)
+        self.code = 0
+        for i, tile in enumerate(tiles):
+            self.code |= tile << (i * layout.bits)
+        self.blank = list(tiles).index(0)
+        
+    @staticmethod
+    def from_state(state):
+        return NPuzzlePackedState(tiles=state.tiles)
+        
+    def _make(self, code, blank):
+        state = NPuzzlePackedState.__new__(NPuzzlePackedState)
+        state.code, state.blank, state.layout = code, blank, self.layout
+        return state
+        
+    @property
+    def N(self):
+        return self.layout.N
+    
+    @property
+    def grid_size(self):
+        return self.layout.grid_size
+    
+    @property
+    def tiles(self):
+        bits, mask, code = self.layout.bits, self.layout.mask, self.code
+        return tuple((code >> (i * bits)) & mask for i in range(self.layout.N + 1))
+    
+    def successors(self):
+        ''' Returns a list of possible actions, their costs and their resulting states.
+        '''
+        code, mask = self.code, self.layout.mask
+        blank_shift = self.blank * self.layout.bits
+        successors = []
+        for action, t, shift in self.layout.moves[self.blank]:
+            tile = (code >> shift) & mask
+            successors.append((self._make(code - (tile << shift) + (tile << blank_shift), t), action, 1))
+        return successors
+    
+    def is_goal(self, goal_state):
+        return self == goal_state
+    
+    def key(self):
+        ''' A compact key of the state for explored sets (see `utils.state_key`)'''
+        return self.code
+    
+    plot = NPuzzleState.plot
+    
+    def __hash__(self):
+        return hash(self.code)
+    
+    def __eq__(self, other):
+        if self is other: return True
+        if other is None: return False
+        if not isinstance(other, NPuzzlePackedState): return False
+        
+        return self.code == other.code
+    
+    __str__ = NPuzzleState.__str__
+    
+    def __repr__(self):
+        return f'NPuzzlePackedState(N={self.N}, tiles={self.tiles})'
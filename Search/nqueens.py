@@ -1,7 +1,8 @@
 import random
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-from IPython.display import clear_output
+from array import array
+
+# NumPy (vectorized neighborhoods) and matplotlib (plots and animations) are imported by the
+# methods which use them, so the plain states load neither
 
 
 class NQueensState:
@@ -17,7 +18,10 @@ class NQueensState:
             self.N = N
             self.queens = list(range(1, N + 1))
 
-        self.num_conflicts = None    
+        self.num_conflicts = None
+        self.row_counts = None       # number of queens on each row (built lazily)
+        self.diag_counts = None      # number of queens on each diagonal (row - col)
+        self.anti_diag_counts = None # number of queens on each anti-diagonal (row + col)
         
     def __eq__(self, other):
         if self is other: return True
@@ -33,15 +37,60 @@ class NQueensState:
     
         return self.conflicts() >= other.conflicts()        
         
+    def _build_counters(self):
+        ''' Counts the queens on every row, diagonal and anti-diagonal (only once per state)'''
+
+        if self.row_counts is not None:
+            return
+
+        N = self.N
+        self.row_counts = [0] * (N + 1)
+        self.diag_counts = [0] * (2 * N)
+        self.anti_diag_counts = [0] * (2 * N)
+        for col, row in enumerate(self.queens):
+            self.row_counts[row] += 1
+            self.diag_counts[row - col + N - 1] += 1
+            self.anti_diag_counts[row + col] += 1
+
     def conflicts(self):
         ''' Computes number of pairs og queens which are on the same row or diagonal'''
 
         if self.num_conflicts is None:
-            self.num_conflicts = sum([abs(self.queens[j] - self.queens[i]) == j - i or self.queens[j] == self.queens[i]
-                                      for i in range(self.N - 1)
-                                      for j in range(i + 1, self.N)])
+            self._build_counters()
+            self.num_conflicts = sum([c * (c - 1) // 2
+                                      for counts in (self.row_counts, self.diag_counts, self.anti_diag_counts)
+                                      for c in counts])
 
         return self.num_conflicts
+
+    def move_delta(self, col, row):
+        ''' Change in number of conflicts if the queen in column `col` is moved to `row` (in O(1))'''
+
+        old_row = self.queens[col]
+        if old_row == row: return 0
+
+        self._build_counters()
+        N = self.N
+
+        # pairs lost by removing the queen from its current row and diagonals
+        removed = (self.row_counts[old_row] - 1 
+                   + self.diag_counts[old_row - col + N - 1] - 1 
+                   + self.anti_diag_counts[old_row + col] - 1)
+
+        # pairs created by putting it on the new row and diagonals
+        added = (self.row_counts[row] 
+                 + self.diag_counts[row - col + N - 1] 
+                 + self.anti_diag_counts[row + col])
+
+        return added - removed
+
+    def neighbor(self, col, row):
+        ''' Create the successor in which the queen in column `col` is moved to `row` '''
+
+        neighbor = NQueensState(queens=self.queens)
+        neighbor.queens[col] = row
+        neighbor.num_conflicts = self.conflicts() + self.move_delta(col, row)
+        return neighbor
                             
     def neighbors(self):
         ''' Create all successors by moving a queen to another row in its column '''
@@ -51,33 +100,63 @@ class NQueensState:
         for col in range(N):
             for row in range(1, N + 1):
                 if self.queens[col] == row: continue
-                neighbor = NQueensState(queens=self.queens)
-                neighbor.queens[col] = row
-                yield neighbor
+                yield self.neighbor(col, row)
 
     
     def best_neighbor(self):
         ''' find a neighbor with minimum number of conflicts'''
 
-        min_conflicts = self.N * (self.N - 1) // 2
+        N = self.N
+        current = self.conflicts()
+        min_conflicts = N * (N - 1) // 2
         best = None
-        for neighbor in self.neighbors():
-            if neighbor.conflicts() < min_conflicts:
-                min_conflicts, best = neighbor.conflicts(), neighbor
-        return best
+        for col in range(N):
+            for row in range(1, N + 1):
+                if self.queens[col] == row: continue
+                conflicts = current + self.move_delta(col, row)
+                if conflicts < min_conflicts:
+                    min_conflicts, best = conflicts, (col, row)
+
+        return None if best is None else self.neighbor(*best)
+
+    def best_neighbor_vectorized(self):
+        ''' Same as `best_neighbor`, but the whole N x N move matrix is scored at once with NumPy'''
+        import numpy as np
+
+        N = self.N
+        queens = np.asarray(self.queens)
+        cols = np.arange(N)
+        rows = np.arange(1, N + 1)
+
+        # number of queens on each row, diagonal and anti-diagonal
+        row_counts = np.bincount(queens, minlength=N + 1)
+        diag_counts = np.bincount(queens - cols + N - 1, minlength=2 * N)
+        anti_diag_counts = np.bincount(queens + cols, minlength=2 * N)
+
+        # conflicts[col, row - 1]: number of conflicts after moving queen in column `col` to `row`
+        removed = (row_counts[queens] + diag_counts[queens - cols + N - 1] + anti_diag_counts[queens + cols] - 3)
+        added = (row_counts[rows][None, :] 
+                 + diag_counts[rows[None, :] - cols[:, None] + N - 1] 
+                 + anti_diag_counts[rows[None, :] + cols[:, None]])
+        conflicts = self.conflicts() + added - removed[:, None]
+
+        # current positions are not neighbors; argmin returns the first minimum, as the loops do
+        max_conflicts = N * (N - 1) // 2
+        conflicts[cols, queens - 1] = max_conflicts
+        best = int(np.argmin(conflicts))
+        if conflicts.flat[best] >= max_conflicts:
+            return None
+        return self.neighbor(best // N, best % N + 1)
     
     def random_neighbor(self):
         ''' find a random neighbor by moving a random queen to another row in its column '''
-        
-        neighbor = NQueensState(queens=self.queens)
 
         col = random.randint(0, self.N - 1)
         row = random.randint(1, self.N)
         while row == col:
             row = random.randint(1, self.N)
         
-        neighbor.queens[col] = row
-        return neighbor
+        return self.neighbor(col, row)
     
     @staticmethod
     def random_state(N=8):
@@ -85,6 +164,7 @@ class NQueensState:
         return NQueensState(queens=queens)
 
     def plot(self, ax=None, figsize=(6, 6), show_conflicts=False, fc='darkslateblue'):
+        import matplotlib.pyplot as plt
         
         if ax is None:
             fig = plt.figure(figsize=figsize)
@@ -146,7 +226,9 @@ class NQueensStatePermutation:
             self.N = N
             self.queens = list(range(1, N + 1))
 
-        self.num_conflicts = None    
+        self.num_conflicts = None
+        self.diag_counts = None      # number of queens on each diagonal (row - col), built lazily
+        self.anti_diag_counts = None # number of queens on each anti-diagonal (row + col)
         
     def __eq__(self, other):
         if self is other: return True
@@ -162,15 +244,70 @@ class NQueensStatePermutation:
     
         return self.conflicts() >= other.conflicts()        
         
+    def _build_counters(self):
+        ''' Counts the queens on every diagonal and anti-diagonal (only once per state)'''
+
+        if self.diag_counts is not None:
+            return
+
+        N = self.N
+        self.diag_counts = [0] * (2 * N)
+        self.anti_diag_counts = [0] * (2 * N)
+        for col, row in enumerate(self.queens):
+            self.diag_counts[row - col + N - 1] += 1
+            self.anti_diag_counts[row + col] += 1
+
+    def _remove(self, col, row):
+        ''' Removes a queen from the counters and returns the change in number of conflicts'''
+
+        d, a = row - col + self.N - 1, row + col
+        self.diag_counts[d] -= 1
+        self.anti_diag_counts[a] -= 1
+        return -(self.diag_counts[d] + self.anti_diag_counts[a])
+
+    def _add(self, col, row):
+        ''' Adds a queen to the counters and returns the change in number of conflicts'''
+
+        d, a = row - col + self.N - 1, row + col
+        delta = self.diag_counts[d] + self.anti_diag_counts[a]
+        self.diag_counts[d] += 1
+        self.anti_diag_counts[a] += 1
+        return delta
+
     def conflicts(self):
         ''' Computes number of pairs og queens which are on the same diagonal'''
 
         if self.num_conflicts is None:
-            self.num_conflicts = sum([abs(self.queens[j] - self.queens[i]) == j - i
-                                      for i in range(self.N - 1)
-                                      for j in range(i + 1, self.N)])
+            self._build_counters()
+            self.num_conflicts = sum([c * (c - 1) // 2
+                                      for counts in (self.diag_counts, self.anti_diag_counts)
+                                      for c in counts])
 
         return self.num_conflicts
+
+    def swap_delta(self, i, j):
+        ''' Change in number of conflicts if queens in columns i and j swap their rows (in O(1))'''
+
+        self._build_counters()
+        row_i, row_j = self.queens[i], self.queens[j]
+
+        # apply the swap on the counters ...
+        delta = self._remove(i, row_i) + self._remove(j, row_j)
+        delta += self._add(i, row_j) + self._add(j, row_i)
+
+        # ... and undo it
+        self._remove(i, row_j), self._remove(j, row_i)
+        self._add(i, row_i), self._add(j, row_j)
+
+        return delta
+
+    def neighbor(self, i, j):
+        ''' Create the successor in which queens in columns i and j are swapped '''
+
+        neighbor = NQueensStatePermutation(queens=self.queens)
+        neighbor.queens[i], neighbor.queens[j] = neighbor.queens[j], neighbor.queens[i]
+        neighbor.num_conflicts = self.conflicts() + self.swap_delta(i, j)
+        return neighbor
                             
     def neighbors(self):
         ''' Create all successors by considering every pair and swaping their position'''
@@ -179,29 +316,66 @@ class NQueensStatePermutation:
         
         for i in range(N - 1):
             for j in range(i + 1, N):
-                neighbor = NQueensStatePermutation(queens=self.queens)
-                neighbor.queens[i], neighbor.queens[j] = neighbor.queens[j], neighbor.queens[i]
-                yield neighbor
+                yield self.neighbor(i, j)
 
     
     def best_neighbor(self):
         ''' find a neighbor with minimum number of conflicts'''
 
-        min_conflicts = self.N * (self.N - 1) // 2
+        N = self.N
+        current = self.conflicts()
+        min_conflicts = N * (N - 1) // 2
         best = None
-        for neighbor in self.neighbors():
-            if neighbor.conflicts() < min_conflicts:
-                min_conflicts, best = neighbor.conflicts(), neighbor
-        return best
+        for i in range(N - 1):
+            for j in range(i + 1, N):
+                conflicts = current + self.swap_delta(i, j)
+                if conflicts < min_conflicts:
+                    min_conflicts, best = conflicts, (i, j)
+
+        return None if best is None else self.neighbor(*best)
+
+    def best_neighbor_vectorized(self):
+        ''' Same as `best_neighbor`, but all N(N-1)/2 swaps are scored at once with NumPy'''
+        import numpy as np
+
+        N = self.N
+        queens = np.asarray(self.queens)
+        cols = np.arange(N)
+
+        # number of queens on each diagonal and anti-diagonal
+        diag_counts = np.bincount(queens - cols + N - 1, minlength=2 * N)
+        anti_diag_counts = np.bincount(queens + cols, minlength=2 * N)
+
+        # row_i[i, j] = queens[i] and row_j[i, j] = queens[j] for the swap of columns i and j
+        i, j = cols[:, None], cols[None, :]
+        row_i, row_j = queens[:, None], queens[None, :]
+        same_row = row_i == row_j
+
+        # pairs lost by taking queens i and j off the board (a pair between i and j is counted once)
+        removed = diag_counts[queens - cols + N - 1] + anti_diag_counts[queens + cols] - 2
+        removed = (removed[:, None] + removed[None, :] 
+                   - (row_i - i == row_j - j) - (row_i + i == row_j + j))
+
+        # pairs created by putting queen i on row_j, then queen j on row_i
+        added_i = diag_counts[row_j - i + N - 1] + anti_diag_counts[row_j + i] - 2 * same_row
+        added_j = (diag_counts[row_i - j + N - 1] + anti_diag_counts[row_i + j] - 2 * same_row
+                   + (row_j - i == row_i - j) + (row_j + i == row_i + j))
+        conflicts = self.conflicts() + added_i + added_j - removed
+
+        # only pairs with i < j are neighbors; argmin returns the first minimum, as the loops do
+        max_conflicts = N * (N - 1) // 2
+        conflicts[np.tril_indices(N)] = max_conflicts
+        best = int(np.argmin(conflicts))
+        if conflicts.flat[best] >= max_conflicts:
+            return None
+        return self.neighbor(best // N, best % N)
     
     def random_neighbor(self):
         ''' find a random neighbor by swaping two randomly selected queens'''
 
         i = random.randint(0, self.N - 2)
         j = random.randint(i + 1, self.N - 1)
-        neighbor = NQueensStatePermutation(queens=self.queens)
-        neighbor.queens[i], neighbor.queens[j] = neighbor.queens[j], neighbor.queens[i]
-        return neighbor
+        return self.neighbor(i, j)
             
     @staticmethod
     def random_state(N=8):
@@ -210,6 +384,8 @@ class NQueensStatePermutation:
         return NQueensStatePermutation(queens=queens)
 
     def plot(self, ax=None, width=512, height=512, show_conflicts=False, fc='darkslateblue'):
+        import matplotlib.pyplot as plt
+
         if ax is None:
             fig = plt.figure()
             ax = fig.add_subplot(1, 1, 1)
@@ -260,6 +436,309 @@ class NQueensStatePermutation:
         return f'NQueensStatePermutation(queens={self.queens})'
     
     
+class NQueensArrayState:
+    ''' N-Queens state based on first formulation, stored in flat int arrays.
+
+        Queens and row/diagonal counters are kept in `array('i')` buffers which are updated in 
+        place by `move()`. Neighbors are evaluated by applying a move and undoing it, so the only 
+        new object is the neighbor which is finally returned.
+    '''
+
+    __slots__ = ('N', 'queens', 'row_counts', 'diag_counts', 'anti_diag_counts', 'num_conflicts')
+    
+    def __init__(self, queens=None, N=8):
+        ''' Constructor '''
+
+        if queens:
+            self.N = len(queens)
+            self.queens = array('i', queens)
+        else:
+            self.N = N
+            self.queens = array('i', range(1, N + 1))
+
+        N = self.N
+        self.row_counts = array('i', [0]) * (N + 1)
+        self.diag_counts = array('i', [0]) * (2 * N)
+        self.anti_diag_counts = array('i', [0]) * (2 * N)
+        self.num_conflicts = 0
+        for col, row in enumerate(self.queens):
+            self.num_conflicts += self._add(col, row)
+
+    def copy(self):
+        ''' A copy of this state (arrays are copied, counters are not rebuilt) '''
+
+        state = NQueensArrayState.__new__(NQueensArrayState)
+        state.N = self.N
+        state.queens = self.queens[:]
+        state.row_counts = self.row_counts[:]
+        state.diag_counts = self.diag_counts[:]
+        state.anti_diag_counts = self.anti_diag_counts[:]
+        state.num_conflicts = self.num_conflicts
+        return state
+        
+    def __eq__(self, other):
+        if self is other: return True
+        if other is None: return False
+        if not isinstance(other, NQueensArrayState): return False
+    
+        return self.queens == other.queens
+    
+    def __ge__(self, other):
+        if self is other: return True
+        if other is None: return False
+        if not isinstance(other, NQueensArrayState): return False
+    
+        return self.conflicts() >= other.conflicts()
+
+    def _remove(self, col, row):
+        ''' Removes a queen from the counters and returns the change in number of conflicts'''
+
+        d, a = row - col + self.N - 1, row + col
+        self.row_counts[row] -= 1
+        self.diag_counts[d] -= 1
+        self.anti_diag_counts[a] -= 1
+        return -(self.row_counts[row] + self.diag_counts[d] + self.anti_diag_counts[a])
+
+    def _add(self, col, row):
+        ''' Adds a queen to the counters and returns the change in number of conflicts'''
+
+        d, a = row - col + self.N - 1, row + col
+        delta = self.row_counts[row] + self.diag_counts[d] + self.anti_diag_counts[a]
+        self.row_counts[row] += 1
+        self.diag_counts[d] += 1
+        self.anti_diag_counts[a] += 1
+        return delta
+        
+    def conflicts(self):
+        ''' Number of pairs og queens which are on the same row or diagonal (kept up to date)'''
+
+        return self.num_conflicts
+
+    def move(self, col, row):
+        ''' Moves the queen in column `col` to `row` in place and returns its previous row.
+            The move is undone by moving the queen back to the returned row.
+        '''
+
+        old_row = self.queens[col]
+        if old_row != row:
+            self.num_conflicts += self._remove(col, old_row) + self._add(col, row)
+            self.queens[col] = row
+        return old_row
+
+    def move_delta(self, col, row):
+        ''' Change in number of conflicts if the queen in column `col` is moved to `row` '''
+
+        current = self.num_conflicts
+        old_row = self.move(col, row)
+        delta = self.num_conflicts - current
+        self.move(col, old_row)
+        return delta
+
+    def neighbor(self, col, row):
+        ''' Create the successor in which the queen in column `col` is moved to `row` '''
+
+        neighbor = self.copy()
+        neighbor.move(col, row)
+        return neighbor
+                            
+    def neighbors(self):
+        ''' Create all successors by moving a queen to another row in its column '''
+
+        N = self.N
+                
+        for col in range(N):
+            for row in range(1, N + 1):
+                if self.queens[col] == row: continue
+                yield self.neighbor(col, row)
+    
+    def best_neighbor(self):
+        ''' find a neighbor with minimum number of conflicts'''
+
+        N = self.N
+        min_conflicts = N * (N - 1) // 2
+        best = None
+        for col in range(N):
+            for row in range(1, N + 1):
+                if self.queens[col] == row: continue
+                old_row = self.move(col, row)
+                conflicts = self.num_conflicts
+                self.move(col, old_row)
+                if conflicts < min_conflicts:
+                    min_conflicts, best = conflicts, (col, row)
+
+        return None if best is None else self.neighbor(*best)
+    
+    def random_neighbor(self):
+        ''' find a random neighbor by moving a random queen to another row in its column '''
+
+        col = random.randint(0, self.N - 1)
+        row = random.randint(1, self.N)
+        while row == col:
+            row = random.randint(1, self.N)
+        
+        return self.neighbor(col, row)
+    
+    @staticmethod
+    def random_state(N=8):
+        queens = [random.randint(1, N) for col in range(N)]
+        return NQueensArrayState(queens=queens)
+
+    best_neighbor_vectorized = NQueensState.best_neighbor_vectorized
+    plot = NQueensState.plot
+        
+    def __str__(self):
+        return f'{list(self.queens)} <{self.conflicts()}>'
+    
+    def __repr__(self):
+        return f'NQueensArrayState(queens={list(self.queens)})'
+
+
+class NQueensArrayStatePermutation:
+    ''' N-Queens state based on permutation formulation, stored in flat int arrays.
+
+        See `NQueensArrayState`: neighbors are evaluated by swapping two queens in place 
+        and swapping them back.
+    '''
+
+    __slots__ = ('N', 'queens', 'diag_counts', 'anti_diag_counts', 'num_conflicts')
+    
+    def __init__(self, queens=None, N=8):
+        ''' Constructor '''
+
+        if queens:
+            self.N = len(queens)
+            self.queens = array('i', queens)
+        else:
+            self.N = N
+            self.queens = array('i', range(1, N + 1))
+
+        N = self.N
+        self.diag_counts = array('i', [0]) * (2 * N)
+        self.anti_diag_counts = array('i', [0]) * (2 * N)
+        self.num_conflicts = 0
+        for col, row in enumerate(self.queens):
+            self.num_conflicts += self._add(col, row)
+
+    def copy(self):
+        ''' A copy of this state (arrays are copied, counters are not rebuilt) '''
+
+        state = NQueensArrayStatePermutation.__new__(NQueensArrayStatePermutation)
+        state.N = self.N
+        state.queens = self.queens[:]
+        state.diag_counts = self.diag_counts[:]
+        state.anti_diag_counts = self.anti_diag_counts[:]
+        state.num_conflicts = self.num_conflicts
+        return state
+        
+    def __eq__(self, other):
+        if self is other: return True
+        if other is None: return False
+        if not isinstance(other, NQueensArrayStatePermutation): return False
+    
+        return self.queens == other.queens
+    
+    def __ge__(self, other):
+        if self is other: return True
+        if other is None: return False
+        if not isinstance(other, NQueensArrayStatePermutation): return False
+    
+        return self.conflicts() >= other.conflicts()
+
+    def _remove(self, col, row):
+        ''' Removes a queen from the counters and returns the change in number of conflicts'''
+
+        d, a = row - col + self.N - 1, row + col
+        self.diag_counts[d] -= 1
+        self.anti_diag_counts[a] -= 1
+        return -(self.diag_counts[d] + self.anti_diag_counts[a])
+
+    def _add(self, col, row):
+        ''' Adds a queen to the counters and returns the change in number of conflicts'''
+
+        d, a = row - col + self.N - 1, row + col
+        delta = self.diag_counts[d] + self.anti_diag_counts[a]
+        self.diag_counts[d] += 1
+        self.anti_diag_counts[a] += 1
+        return delta
+        
+    def conflicts(self):
+        ''' Number of pairs og queens which are on the same diagonal (kept up to date)'''
+
+        return self.num_conflicts
+
+    def swap(self, i, j):
+        ''' Swaps queens in columns i and j in place (swapping again undoes it)'''
+
+        row_i, row_j = self.queens[i], self.queens[j]
+        delta = self._remove(i, row_i) + self._remove(j, row_j)
+        delta += self._add(i, row_j) + self._add(j, row_i)
+        self.queens[i], self.queens[j] = row_j, row_i
+        self.num_conflicts += delta
+
+    def swap_delta(self, i, j):
+        ''' Change in number of conflicts if queens in columns i and j swap their rows '''
+
+        current = self.num_conflicts
+        self.swap(i, j)
+        delta = self.num_conflicts - current
+        self.swap(i, j)
+        return delta
+
+    def neighbor(self, i, j):
+        ''' Create the successor in which queens in columns i and j are swapped '''
+
+        neighbor = self.copy()
+        neighbor.swap(i, j)
+        return neighbor
+                            
+    def neighbors(self):
+        ''' Create all successors by considering every pair and swaping their position'''
+
+        N = self.N
+        
+        for i in range(N - 1):
+            for j in range(i + 1, N):
+                yield self.neighbor(i, j)
+    
+    def best_neighbor(self):
+        ''' find a neighbor with minimum number of conflicts'''
+
+        N = self.N
+        min_conflicts = N * (N - 1) // 2
+        best = None
+        for i in range(N - 1):
+            for j in range(i + 1, N):
+                self.swap(i, j)
+                conflicts = self.num_conflicts
+                self.swap(i, j)
+                if conflicts < min_conflicts:
+                    min_conflicts, best = conflicts, (i, j)
+
+        return None if best is None else self.neighbor(*best)
+    
+    def random_neighbor(self):
+        ''' find a random neighbor by swaping two randomly selected queens'''
+
+        i = random.randint(0, self.N - 2)
+        j = random.randint(i + 1, self.N - 1)
+        return self.neighbor(i, j)
+            
+    @staticmethod
+    def random_state(N=8):
+        queens = list(range(1, N + 1))
+        random.shuffle(queens)
+        return NQueensArrayStatePermutation(queens=queens)
+
+    best_neighbor_vectorized = NQueensStatePermutation.best_neighbor_vectorized
+    plot = NQueensStatePermutation.plot
+        
+    def __str__(self):
+        return f'{list(self.queens)} <{self.conflicts()}>'
+    
+    def __repr__(self):
+        return f'NQueensArrayStatePermutation(queens={list(self.queens)})'
+    
+    
 def summarize_history(history):
     ''' Remove states that are equal to their previous state in the history (for animation)
     '''
@@ -277,6 +756,13 @@ def create_animation(history,
                      xlabel="Generation", 
                      ylabel="Conflicts",
                      interval=200):
+    ''' Animates a list of states or a `History` of a search (only the states it kept are shown)'''
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FuncAnimation
+    
+    history = list(history)
+    if not history:
+        raise ValueError("No states to animate, search with history='full', 'every' or 'last'")
     
     hist = summarize_history(history) if summarize else history
     
@@ -0,0 +1,351 @@
+"""
+ Solves many N-Puzzle, N-Queens and TSP instances in parallel processes and streams the results.
+
+     python solve.py instances.jsonl -o results.jsonl [-w 4] [--time-limit 60]
+     cat instances.jsonl | python solve.py - > results.jsonl
+
+ Every input line is a JSON object describing one instance, e.g.
+
+     {"id": "p1", "problem": "npuzzle", "tiles": [8, 6, 7, 2, 5, 4, 3, 0, 1], "goal": [1, 2, 3, 4, 5, 6, 7, 8, 0]}
+     {"id": "q1", "problem": "nqueens", "N": 1000, "algorithm": "min-conflicts", "seed": 1}
+     {"id": "t1", "problem": "tsp", "cities": "../data/ir.csv", "n": 100, "algorithm": "nearest-neighbor"}
+
+ Instances without an "id" get a hash of their line as id. The optional keys are "algorithm" (see
+ ALGORITHMS, the first one is the default), "heuristic" for informed N-Puzzle searches, "seed",
+ "time_limit" (seconds) and "params" (keyword arguments of the solver). A TSP instance has either
+ "cities" (a CSV file with lat and lng columns) or "points" (a list of [lng, lat]), and "improve" to
+ run 2-opt/Or-opt on the tour (default for the constructive algorithms).
+
+ One JSON line is written per instance as soon as it finishes: its id, status ('solved', 'failed',
+ 'unsolvable', 'timeout', 'error', or 'invalid' for a line which is not a JSON object), solution
+ (actions, queen rows or city order), cost (path length, conflicts or tour length), stats (see
+ `utils.Stats`) and wall time. Only a bounded number of instances is read ahead, so memory does not
+ grow with the input.
+
+ Instances which already have a final result ('solved', 'failed', 'unsolvable' or 'invalid') in the
+ output file are skipped, so an interrupted run is resumed by running it again; instances which
+ timed out or raised an error are run again and get a new line (the last line of an id is its
+ latest result). The ids of the finished instances are kept in memory, so that set grows with the
+ output file.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import random
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from utils import Stats
+
+
+ALGORITHMS = {
+    'npuzzle': ('astar', 'idastar', 'greedy', 'bfs', 'bfs-bidirectional', 'ucs', 'ucs-bidirectional'),
+    'nqueens': ('min-conflicts', 'simulated-annealing', 'hill-climbing'),
+    'tsp': ('nearest-neighbor', 'mst', 'simulated-annealing'),
+}
+HEURISTICS = ('linear-conflict', 'manhattan', 'pattern-database')
+
+_cache = {}  # heuristics and cities loaded by a worker process, reused by its next instances
+
+
+class TimeLimitExceeded(Exception):
+    pass
+
+
+def _alarm(signum, frame):
+    raise TimeLimitExceeded()
+
+
+def _cached(key, make):
+    if key not in _cache:
+        _cache[key] = make()
+    return _cache[key]
+
+
+def _solvable(tiles, goal, grid_size):
+    ''' A puzzle is solvable iff the parity of the permutation from tiles to goal (blank included)
+        is the parity of the Manhattan distance between the blank positions.
+    '''
+    position = {tile: i for i, tile in enumerate(goal)}
+    permutation = [position[tile] for tile in tiles]
+    swaps, seen = 0, [False] * len(tiles)  # a cycle of length k is k - 1 swaps
+    for i in range(len(tiles)):
+        length, j = 0, i
+        while not seen[j]:
+            seen[j], j = True, permutation[j]
+            length += 1
+        swaps += max(length - 1, 0)
+    b, g = tiles.index(0), goal.index(0)
+    distance = abs(b // grid_size - g // grid_size) + abs(b % grid_size - g % grid_size)
+    return swaps % 2 == distance % 2
+
+
+def solve_npuzzle(instance, algorithm, stats):
+    from npuzzle import NPuzzlePackedState
+    from strategies import BFS, UCS, Greedy, AStar, IDAStar
+    from heuristics import ManhattanDistance, LinearConflict, PatternDatabase
+
+    tiles = tuple(instance['tiles'])
+    goal = tuple(instance.get('goal') or range(len(tiles)))
+    grid_size, numbers = int(len(tiles) ** 0.5), list(range(len(tiles)))
+    if grid_size < 2 or grid_size ** 2 != len(tiles) or sorted(tiles) != numbers or sorted(goal) != numbers:
+        raise ValueError('tiles and goal must be permutations of 0..N where N + 1 is a square')
+
+    start_state, goal_state = NPuzzlePackedState(tiles=tiles), NPuzzlePackedState(tiles=goal)
+    if not _solvable(tiles, goal, grid_size):
+        return 'unsolvable', None, None
+
+    params = instance.get('params', {})
+    if algorithm in ('astar', 'idastar', 'greedy'):
+        name = instance.get('heuristic', HEURISTICS[0])
+        make = {'manhattan': ManhattanDistance, 'linear-conflict': LinearConflict,
+                'pattern-database': PatternDatabase}[name]
+        heuristic = _cached((name, goal), lambda: make(goal_state))
+        search = {'astar': AStar, 'idastar': IDAStar, 'greedy': Greedy}[algorithm](stats=stats)
+        path = search(start_state, goal_state, heuristic, **params)
+    else:
+        strategy, _, bidirectional = algorithm.partition('-')
+        search = {'bfs': BFS, 'ucs': UCS}[strategy](bidirectional=bool(bidirectional), stats=stats)
+        path = search(start_state, goal_state)
+
+    if path is None:
+        return 'failed', None, None
+    return 'solved', [action for _, action in path], len(path)
+
+
+def solve_nqueens(instance, algorithm, stats):
+    from nqueens import NQueensArrayStatePermutation
+    from local_search import HillClimbing, SimulatedAnnealing, MinConflicts
+
+    N, params = instance['N'], instance.get('params', {})
+    if algorithm == 'min-conflicts':
+        solver = MinConflicts(history='off')
+        start_time = time.perf_counter()
+        try:
+            state = solver.search(N=N, **params)
+        finally:  # a timeout keeps the steps done so far
+            stats.record('search', time.perf_counter() - start_time, iterations=getattr(solver, 'num_steps', 0))
+    elif algorithm == 'simulated-annealing':
+        solver = SimulatedAnnealing(history='off', stats=stats)
+        solver.search(NQueensArrayStatePermutation.random_state(N), **params)
+        state = solver.best
+    else:
+        solver = HillClimbing(history='off', stats=stats)
+        state = solver.search(NQueensArrayStatePermutation.random_state(N), vectorized=True, **params)
+
+    conflicts = state.conflicts()
+    return 'solved' if conflicts == 0 else 'failed', [int(row) for row in state.queens], conflicts
+
+
+def solve_tsp(instance, algorithm, stats):
+    from tsp_utils import (Cities, Tour, parse_cities, simulated_annealing, nearest_neighbor_tour,
+                           mst_tour, improve_tour)
+
+    if 'cities' in instance:
+        cities = _cached(('cities', instance['cities']), lambda: parse_cities(instance['cities']))
+    else:
+        xs, ys = zip(*instance['points'])
+        cities = Cities(xs, ys)
+    if instance.get('n'):
+        cities = cities[:instance['n']]
+
+    params = instance.get('params', {})
+    start_time = time.perf_counter()
+    if algorithm == 'simulated-annealing':
+        tour, _ = simulated_annealing(Tour(cities), stats=stats, **params)
+    else:
+        tour = nearest_neighbor_tour(cities) if algorithm == 'nearest-neighbor' else mst_tour(cities)
+        stats.record('construction', time.perf_counter() - start_time)
+
+    if instance.get('improve', algorithm != 'simulated-annealing'):
+        with stats.phase('improvement'):
+            tour = improve_tour(tour)
+    return 'solved', [int(city) for city in tour.ids], float(tour.length())
+
+
+SOLVERS = {'npuzzle': solve_npuzzle, 'nqueens': solve_nqueens, 'tsp': solve_tsp}
+
+
+def solve(instance_id, instance, time_limit=None):
+    ''' Solves one instance (in a worker process) and returns its result as a dict. The time limit
+        is enforced with a timer signal where the platform has one (not on Windows).
+    '''
+    result = {'id': instance_id, 'problem': instance.get('problem'), 'algorithm': None,
+              'status': None, 'solution': None, 'cost': None}
+    stats = Stats()
+    time_limit = instance.get('time_limit', time_limit)
+    timer = bool(time_limit) and hasattr(signal, 'setitimer')
+    start_time = time.perf_counter()
+
+    try:
+        problem = instance['problem']
+        if problem not in SOLVERS:
+            raise ValueError(f'Unknown problem {problem!r}, expected one of {tuple(SOLVERS)}')
+        algorithm = result['algorithm'] = instance.get('algorithm', ALGORITHMS[problem][0])
+        if algorithm not in ALGORITHMS[problem]:
+            raise ValueError(f'Unknown algorithm {algorithm!r}, expected one of {ALGORITHMS[problem]}')
+
+        random.seed(instance.get('seed', 0))
+        if timer:
+            signal.signal(signal.SIGALRM, _alarm)
+            signal.setitimer(signal.ITIMER_REAL, time_limit)
+        try:
+            result['status'], result['solution'], result['cost'] = SOLVERS[problem](instance, algorithm, stats)
+        finally:
+            if timer:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except TimeLimitExceeded:
+        result['status'] = 'timeout'
+    except Exception as e:
+        result['status'], result['error'] = 'error', f'{type(e).__name__}: {e}'
+
+    result['stats'] = stats.snapshot()
+    result['wall_time'] = time.perf_counter() - start_time
+    return result
+
+
+def read_instances(f):
+    ''' Yields (id, instance) for every non-empty line of f, instance is None if the line is invalid'''
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            instance = json.loads(line)
+            if not isinstance(instance, dict):
+                raise ValueError
+        except ValueError:
+            yield hashlib.sha1(line.encode()).hexdigest()[:16], None
+            continue
+
+        instance_id = instance.get('id')
+        if instance_id is None:
+            canonical = json.dumps(instance, sort_keys=True, separators=(',', ':'))
+            instance_id = hashlib.sha1(canonical.encode()).hexdigest()[:16]
+        yield str(instance_id), instance
+
+
+FINISHED = ('solved', 'failed', 'unsolvable', 'invalid')  # statuses which running again would not change
+
+
+def finished_ids(fname):
+    ''' Ids of the results with a FINISHED status in an output file (an incomplete last line is 
+        ignored). Timeouts and errors are not finished, so they are run again.
+    '''
+    ids = set()
+    if fname and os.path.exists(fname):
+        with open(fname) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                    if result['status'] in FINISHED:
+                        ids.add(str(result['id']))
+                except (ValueError, KeyError, TypeError):
+                    pass
+    return ids
+
+
+def _error(instance_id, instance, error):
+    ''' Result of an instance which could not be solved by a worker '''
+    return {'id': instance_id, 'problem': instance.get('problem'), 'algorithm': instance.get('algorithm'),
+            'status': 'error', 'solution': None, 'cost': None, 'error': error, 'wall_time': None}
+
+
+def run(instances, output, workers=None, time_limit=None, skip=(), max_tasks_per_child=None, verbose=1):
+    ''' Solves (id, instance) pairs in a process pool and writes a JSON line to output for each
+        result as soon as it is available. At most 2 * workers instances are read ahead.
+        If a worker process dies (e.g. killed when it runs out of memory, which the time limit
+        cannot prevent), the instances which were running in the pool get an 'error' line and a
+        new pool takes the next instances. Returns the number of results of every status.
+    '''
+    workers = workers or os.cpu_count()
+    counts = {'skipped': 0}
+    kwargs = {'max_tasks_per_child': max_tasks_per_child} if max_tasks_per_child else {}
+    executor = ProcessPoolExecutor(workers, **kwargs)
+    pending = {}  # future -> (id, instance, pool which runs it)
+
+    def write(result):
+        output.write(json.dumps(result) + '\n')
+        output.flush()
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+        if verbose:
+            wall_time = f" ({result['wall_time']:.3f}s)" if result.get('wall_time') is not None else ''
+            print(f"{result['id']}: {result['status']} cost={result.get('cost')}{wall_time}",
+                  file=sys.stderr, flush=True)
+
+    def new_pool():
+        nonlocal executor
+        executor.shutdown(wait=False)
+        executor = ProcessPoolExecutor(workers, **kwargs)
+
+    def collect():
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            instance_id, instance, pool = pending.pop(future)
+            try:
+                write(future.result())
+            except BrokenProcessPool as e:
+                write(_error(instance_id, instance, f'{type(e).__name__}: {e}'))
+                if pool is executor:  # the other instances of the pool fail the same way
+                    new_pool()
+
+    try:
+        for instance_id, instance in instances:
+            if instance_id in skip:
+                counts['skipped'] += 1
+                continue
+            if instance is None:
+                write({'id': instance_id, 'status': 'invalid', 'error': 'invalid JSON object'})
+                continue
+
+            try:
+                future = executor.submit(solve, instance_id, instance, time_limit)
+            except BrokenProcessPool:  # broken before its failed instances were collected
+                new_pool()
+                future = executor.submit(solve, instance_id, instance, time_limit)
+            pending[future] = (instance_id, instance, executor)
+            if len(pending) >= 2 * workers:
+                collect()
+
+        while pending:
+            collect()
+    finally:
+        executor.shutdown()
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve N-Puzzle, N-Queens and TSP instances in parallel')
+    parser.add_argument('input', nargs='?', default='-', help='JSONL file of instances (default: stdin)')
+    parser.add_argument('-o', '--output', help='JSONL file for the results, appended to and used to '
+                                               'skip finished instances (default: stdout)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('-t', '--time-limit', type=float, default=None, help='seconds per instance')
+    parser.add_argument('--max-tasks-per-child', type=int, default=None,
+                        help='restart worker processes after this many instances (Python 3.11+)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='no progress on stderr')
+    args = parser.parse_args(argv)
+
+    skip = finished_ids(args.output)
+    f = sys.stdin if args.input == '-' else open(args.input)
+    output = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        counts = run(read_instances(f), output, args.workers, args.time_limit, skip,
+                     args.max_tasks_per_child, verbose=not args.quiet)
+    finally:
+        if f is not sys.stdin: f.close()
+        if output is not sys.stdout: output.close()
+
+    if not args.quiet:
+        print(', '.join(f'{status} = {count}' for status, count in counts.items()), file=sys.stderr)
+    return 1 if counts.get('error') or counts.get('invalid') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
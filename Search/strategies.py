@@ -0,0 +1,485 @@
+import time
+
+from utils import Queue, IndexedPriorityQueue, Node, solution, state_key
+from heuristics import ManhattanDistance
+
+
+def _action(state, next_state):
+    ''' The action which goes from state to next_state '''
+    return next(action for successor, action, _ in state.successors() if successor == next_state)
+
+
+def _splice(forward_node, backward_node):
+    ''' Path from the start to the goal through the state of forward_node and backward_node: the
+        forward half as in `solution` and the backward half with the actions reversed (the actions
+        are found with `successors()`, so moves must be reversible).
+    '''
+    path = solution(forward_node)
+    state, node = backward_node.state, backward_node.parent
+    while node is not None:
+        path.append((node.state, _action(state, node.state)))
+        state, node = node.state, node.parent
+    return path
+
+
+class _Strategy:
+    ''' Counters of a search strategy. They are reset by every search (with the frontier and the
+        reached states of a subclass), and added to `stats` (a `utils.Stats`) when the search ends,
+        together with its time.
+    '''
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        self._reset()
+
+    def _reset(self):
+        self.num_generated = self.num_expanded = self.num_duplicates = self.max_frontier = 0
+        self.on_expand = self.stats.hook('expand') if self.stats is not None else None
+        self._start_time = time.perf_counter()
+
+    def _record(self, **counters):
+        if self.stats is not None:
+            self.stats.record('search', time.perf_counter() - self._start_time,
+                              expanded=self.num_expanded, generated=self.num_generated,
+                              duplicates=self.num_duplicates, max_frontier=self.max_frontier, **counters)
+
+
+class BFS(_Strategy):
+    ''' Breadth-First Search strategy. With `bidirectional`, it alternately expands a whole 
+        layer of the forward search (from the start) or the backward search (from the goal), 
+        the smaller one first, until a generated state has been reached by the other search.
+    '''
+    
+    def __init__(self, bidirectional=False, stats=None):
+        super().__init__(stats)
+        self.bidirectional = bidirectional
+
+    def _reset(self):
+        super()._reset()
+        self.frontier = Queue()
+        self.reached = set()
+
+    def search(self, start_state, goal_state):
+        self._reset()
+        try:
+            if start_state == goal_state:
+                return solution(Node(start_state))
+            if self.bidirectional:
+                return self._bidirectional_search(start_state, goal_state)
+            return self._search(start_state, goal_state)
+        finally:
+            self._record()  # also when the search is interrupted (e.g. by a time limit)
+
+    def _search(self, start_state, goal_state):
+        goal_key = state_key(goal_state)
+        self.frontier.push(Node(start_state))
+        self.reached.add(state_key(start_state))
+        on_expand, track = self.on_expand, self.stats is not None
+
+        while not self.frontier.is_empty():
+            if track and len(self.frontier) > self.max_frontier: self.max_frontier = len(self.frontier)
+            
+            # select a candidate node
+            node = self.frontier.pop()
+            self.num_expanded += 1
+            if on_expand is not None: on_expand(node)
+
+            # expand
+            for successor, action, step_cost in node.state.successors():
+                self.num_generated += 1
+                key = state_key(successor)
+
+                if key == goal_key:
+                    return solution(Node(successor, node, action, node.g + step_cost))
+
+                if key not in self.reached:
+                    self.reached.add(key)
+                    self.frontier.push(Node(successor, node, action, node.g + step_cost))
+                else:
+                    self.num_duplicates += 1
+
+        return None  # if no solution found
+    
+    def _bidirectional_search(self, start_state, goal_state):
+        layers = [[Node(start_state)], [Node(goal_state)]]
+        forward = {state_key(start_state): layers[0][0]}   # reached states of each search
+        backward = {state_key(goal_state): layers[1][0]}
+        on_expand, track = self.on_expand, self.stats is not None
+        
+        while layers[0] and layers[1]:
+            if track and len(layers[0]) + len(layers[1]) > self.max_frontier: 
+                self.max_frontier = len(layers[0]) + len(layers[1])
+            
+            side = 0 if len(layers[0]) <= len(layers[1]) else 1
+            reached, other = (forward, backward) if side == 0 else (backward, forward)
+            
+            # expand a whole layer, so that the shortest of the paths found in it is optimal
+            best, layer = None, []
+            for node in layers[side]:
+                self.num_expanded += 1
+                if on_expand is not None: on_expand(node)
+                
+                for successor, action, step_cost in node.state.successors():
+                    self.num_generated += 1
+                    key = state_key(successor)
+                    if key in reached:
+                        self.num_duplicates += 1
+                        continue
+                        
+                    child_node = Node(successor, node, action, node.g + step_cost)
+                    reached[key] = child_node
+                    layer.append(child_node)
+                    
+                    if key in other:
+                        cost = child_node.g + other[key].g
+                        if best is None or cost < best[0]:
+                            best = (cost, child_node, other[key])
+                            
+            if best is not None:
+                _, node, other_node = best
+                return _splice(node, other_node) if side == 0 else _splice(other_node, node)
+            layers[side] = layer
+            
+        self.reached = set(forward) | set(backward)
+        return None  # if no solution found
+    
+    def __call__(self, start_state, goal_state):
+        return self.search(start_state, goal_state)
+
+
+class UCS(_Strategy):
+    ''' Uniform Cost Search. With `bidirectional`, it alternately expands the cheapest node of 
+        the forward search (from the start) and of the backward search (from the goal), and stops 
+        when the costs of the last expanded nodes add up to the cheapest path found through a 
+        state reached by both searches.
+    '''
+    
+    def __init__(self, bidirectional=False, stats=None):
+        super().__init__(stats)
+        self.bidirectional = bidirectional
+
+    def _reset(self):
+        super()._reset()
+        self.frontier = IndexedPriorityQueue()
+        self.reached = dict()  # a dictionary of (state key, node)
+
+    def search(self, start_state, goal_state):
+        self._reset()
+        try:
+            if self.bidirectional:
+                return self._bidirectional_search(start_state, goal_state)
+            return self._search(start_state, goal_state)
+        finally:
+            self._record()
+
+    def _search(self, start_state, goal_state):
+        node = Node(start_state)
+        key = state_key(start_state)
+        self.frontier.push(node, 0, key)  # push node, its priority and its key
+        self.reached[key] = node
+        on_expand, track = self.on_expand, self.stats is not None
+
+        while not self.frontier.is_empty():
+            if track and len(self.frontier) > self.max_frontier: self.max_frontier = len(self.frontier)
+            
+            # select a candidate node
+            node = self.frontier.pop()
+
+            # goal test
+            if node.state == goal_state:
+                return solution(node)
+
+            # expand        
+            self.num_expanded += 1
+            if on_expand is not None: on_expand(node)
+            
+            for successor, action, step_cost in node.state.successors():
+                self.num_generated += 1
+                path_cost = node.g + step_cost
+                key = state_key(successor)
+
+                if key not in self.reached or path_cost < self.reached[key].g:
+                    child_node = Node(successor, node, action, path_cost)
+                    self.reached[key] = child_node
+                    self.frontier.push(child_node, path_cost, key)
+                else:
+                    self.num_duplicates += 1
+
+        return None  # if no solution found
+    
+    def _bidirectional_search(self, start_state, goal_state):
+        frontiers = [IndexedPriorityQueue(), IndexedPriorityQueue()]
+        start_key, goal_key = state_key(start_state), state_key(goal_state)
+        reached = [{start_key: Node(start_state)}, {goal_key: Node(goal_state)}]
+        frontiers[0].push(reached[0][start_key], 0, start_key)
+        frontiers[1].push(reached[1][goal_key], 0, goal_key)
+        on_expand, track = self.on_expand, self.stats is not None
+        
+        last_costs = [0, 0]  # costs of the last expanded nodes, lower bounds of the frontiers
+        best = (start_key, 0) if start_key == goal_key else None  # (key of meeting state, cost)
+        side = 1
+        
+        while not frontiers[0].is_empty() and not frontiers[1].is_empty():
+            if best is not None and last_costs[0] + last_costs[1] >= best[1]:
+                break
+                
+            if track and len(frontiers[0]) + len(frontiers[1]) > self.max_frontier: 
+                self.max_frontier = len(frontiers[0]) + len(frontiers[1])
+            
+            side = 1 - side
+            node = frontiers[side].pop()
+            last_costs[side] = node.g
+            self.num_expanded += 1
+            if on_expand is not None: on_expand(node)
+            
+            for successor, action, step_cost in node.state.successors():
+                self.num_generated += 1
+                path_cost = node.g + step_cost
+                key = state_key(successor)
+                
+                if key not in reached[side] or path_cost < reached[side][key].g:
+                    child_node = Node(successor, node, action, path_cost)
+                    reached[side][key] = child_node
+                    frontiers[side].push(child_node, path_cost, key)
+                    
+                    if key in reached[1 - side]:
+                        cost = path_cost + reached[1 - side][key].g
+                        if best is None or cost < best[1]:
+                            best = (key, cost)
+                else:
+                    self.num_duplicates += 1
+        
+        self.reached = {**reached[1], **reached[0]}
+        if best is None:
+            return None  # if no solution found
+        return _splice(reached[0][best[0]], reached[1][best[0]])
+    
+    def __call__(self, start_state, goal_state):
+        return self.search(start_state, goal_state)
+
+
+def _expand(state, heuristic, goal_state, value):
+    ''' Successors of state with their heuristic values, incrementally if the heuristic supports it
+        (see `heuristics.ManhattanDistance`).
+    '''
+    if hasattr(heuristic, 'successors'):
+        return heuristic.successors(state, value)
+    return [(successor, action, step_cost, heuristic(successor, goal_state))
+            for successor, action, step_cost in state.successors()]
+
+
+class Greedy(_Strategy):
+    '''Greedy Search'''
+
+    def _reset(self):
+        super()._reset()
+        self.frontier = IndexedPriorityQueue()
+        self.reached = dict()  # a dictionary of (state key, node)
+
+    def search(self, start_state, goal_state, heuristic):
+        self._reset()
+        try:
+            return self._search(start_state, goal_state, heuristic)
+        finally:
+            self._record(heuristic_calls=self.num_generated + 1)
+
+    def _search(self, start_state, goal_state, heuristic):
+        h = heuristic(start_state, goal_state)
+        node = Node(start_state)
+        key = state_key(start_state)
+        self.frontier.push((node, h), h, key)
+        self.reached[key] = node
+        on_expand, track = self.on_expand, self.stats is not None
+
+        while not self.frontier.is_empty():
+            if track and len(self.frontier) > self.max_frontier: self.max_frontier = len(self.frontier)
+            
+            # select a node
+            node, h = self.frontier.pop()
+
+            # goal test
+            if node.state == goal_state:
+                return solution(node)
+
+            # expand
+            self.num_expanded += 1
+            if on_expand is not None: on_expand(node)
+            
+            for successor, action, step_cost, h in _expand(node.state, heuristic, goal_state, h):
+                self.num_generated += 1
+                path_cost = node.g + step_cost
+                key = state_key(successor)
+
+                if key not in self.reached or path_cost < self.reached[key].g:
+                    child_node = Node(successor, node, action, path_cost)
+                    self.reached[key] = child_node
+                    self.frontier.push((child_node, h), h, key)
+                else:
+                    self.num_duplicates += 1
+
+        return None  # no solution found
+
+    def __call__(self, start_state, goal_state, heuristic):
+        return self.search(start_state, goal_state, heuristic)
+
+
+class AStar(_Strategy):
+    '''A-Star Search'''
+
+    def _reset(self):
+        super()._reset()
+        self.frontier = IndexedPriorityQueue()
+        self.reached = dict()  # a dictionary of (state key, node)
+
+    def search(self, start_state, goal_state, heuristic):
+        self._reset()
+        try:
+            return self._search(start_state, goal_state, heuristic)
+        finally:
+            self._record(heuristic_calls=self.num_generated + 1)
+
+    def _search(self, start_state, goal_state, heuristic):
+        h = heuristic(start_state, goal_state)
+        node = Node(start_state)
+        key = state_key(start_state)
+        self.frontier.push((node, h), 0 + h, key)
+        self.reached[key] = node
+        on_expand, track = self.on_expand, self.stats is not None
+
+        while not self.frontier.is_empty():
+            if track and len(self.frontier) > self.max_frontier: self.max_frontier = len(self.frontier)
+            
+            # select a node
+            node, h = self.frontier.pop()
+
+            # goal test
+            if node.state == goal_state:
+                return solution(node)
+
+            # expand
+            self.num_expanded += 1
+            if on_expand is not None: on_expand(node)
+            
+            for successor, action, step_cost, h in _expand(node.state, heuristic, goal_state, h):
+                self.num_generated += 1
+                path_cost = node.g + step_cost
+                key = state_key(successor)
+
+                if key not in self.reached or path_cost < self.reached[key].g:
+                    child_node = Node(successor, node, action, path_cost)
+                    self.reached[key] = child_node
+                    self.frontier.push((child_node, h), path_cost + h, key)
+                else:
+                    self.num_duplicates += 1
+
+        return None  # no solution found
+
+    def __call__(self, start_state, goal_state, heuristic):
+        return self.search(start_state, goal_state, heuristic)
+
+
+class IDAStar(_Strategy):
+    ''' Iterative Deepening A-Star Search: depth-first searches bounded by f = g + h, with the bound 
+        raised to the smallest f which exceeded it, until the goal is found. 
+
+        Only the current path is kept (O(depth) memory). Moves are applied to one list of tiles (and 
+        the positions of the tiles) and undone in place, the move which goes back to the parent is 
+        pruned and the heuristic is updated incrementally with `heuristic.delta` (see `heuristics`). 
+        Works for N-Puzzle states (`tiles`, `grid_size`, `successors()`) and returns a path of 
+        (state, action) like the other strategies. The expand hook of `stats` is called with the 
+        position of the blank, since no nodes are created.
+    '''
+
+    def __init__(self, stats=None):
+        super().__init__(stats)
+        self.thresholds = []
+
+    def search(self, start_state, goal_state, heuristic=None, max_threshold=200):
+        self._reset()
+        self.thresholds = []
+        try:
+            return self._search(start_state, goal_state, heuristic, max_threshold)
+        finally:
+            if self.stats is not None:  # no frontier and no duplicate detection
+                self.stats.record('search', time.perf_counter() - self._start_time,
+                                  expanded=self.num_expanded, generated=self.num_generated,
+                                  heuristic_calls=self.num_generated + len(self.thresholds) + 1,
+                                  iterations=len(self.thresholds))
+
+    def _search(self, start_state, goal_state, heuristic, max_threshold):
+        if heuristic is None:
+            heuristic = ManhattanDistance(goal_state)
+
+        gs = start_state.grid_size
+        tiles, goal = list(start_state.tiles), list(goal_state.tiles)
+        n = len(tiles)
+        position = [0] * n  # position[t]: position of tile t
+        for i, t in enumerate(tiles):
+            position[t] = i
+        delta = heuristic.delta
+        on_expand = self.on_expand
+
+        # moves[blank]: positions the blank can move to
+        moves = [tuple(t for ok, t in [(b % gs > 0, b - 1), (b >= gs, b - gs), 
+                                       (b % gs < gs - 1, b + 1), (b + gs < n, b + gs)] if ok)
+                 for b in range(n)]
+        path = []  # positions of the blank after each move
+        found = -1
+        
+        def dfs(blank, parent, g, h, bound):
+            ''' Returns found if the goal is reached, otherwise the smallest f above bound '''
+            if h == 0 and tiles == goal:
+                return found
+
+            self.num_expanded += 1
+            if on_expand is not None: on_expand(blank)
+
+            minimum = max_threshold + 1
+            g += 1
+            for src in moves[blank]:
+                if src == parent:
+                    continue
+                self.num_generated += 1
+
+                tile = tiles[src]
+                h_child = h + delta(tiles, tile, src, blank, position)
+                f = g + h_child
+                if f > bound:
+                    if f < minimum: minimum = f
+                    continue
+
+                tiles[blank], tiles[src] = tile, 0
+                position[tile], position[0] = blank, src
+                path.append(src)
+                f = dfs(src, blank, g, h_child, bound)
+                if f == found:
+                    return found
+                path.pop()
+                tiles[blank], tiles[src] = 0, tile
+                position[tile], position[0] = src, blank
+                
+                if f < minimum: minimum = f
+            return minimum
+
+        blank = tiles.index(0)
+        bound = heuristic(start_state, goal_state)
+        while bound <= max_threshold:
+            self.thresholds.append(bound)
+            bound = dfs(blank, None, 0, heuristic(start_state, goal_state), bound)
+            if bound == found:
+                return self._solution(start_state, path)
+
+        return None  # no solution within max_threshold
+
+    def __call__(self, start_state, goal_state, heuristic=None, max_threshold=200):
+        return self.search(start_state, goal_state, heuristic, max_threshold)
+
+    @staticmethod
+    def _solution(start_state, blanks):
+        ''' Path of (state, action) which moves the blank to the given positions '''
+        path, state = [], start_state
+        for blank in blanks:
+            state, action = next((successor, action) for successor, action, _ in state.successors() 
+                                 if successor.tiles[blank] == 0)
+            path.append((state, action))
+        return path
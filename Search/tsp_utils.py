@@ -1,27 +1,123 @@
+import os
 import math
+import time
+import heapq
 import random
-import pandas as pd
-import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
-from matplotlib import animation
-from copy import deepcopy
+import tempfile
+import weakref
+from collections import deque
+
+from kdtree import KDTree
+from utils import stats_hooks
+
+# NumPy (coordinates and distance matrices), pandas (reading CSV files that are not cached yet), 
+# matplotlib and Basemap (plots) are imported inside the functions which use them, so importing 
+# this module loads none of them
 
 
 def parse_latlng(fname):
+    import pandas as pd
+    
     data = pd.read_csv(fname)
     lat, lng = data['lat'].values, data['lng'].values
     return list([Point2D(x, y) for x, y in zip(lng, lat)])
 
 
+def parse_cities(fname, x_scale=94.05163, y_scale=110.89431, cache=True):
+    ''' Reads the cities of a CSV file (with `lat` and `lng` columns) into a compact `Cities` set.
+    
+        With `cache`, projected coordinates are saved next to the file (`<fname>.npy`) and later 
+        calls memory-map them instead of parsing the CSV again (the cache is rebuilt when the CSV 
+        is newer or the scales differ).
+    '''
+    import numpy as np
+    
+    cache_fname = fname + '.npy'
+    if cache and os.path.exists(cache_fname) and os.path.getmtime(cache_fname) >= os.path.getmtime(fname):
+        # column 0 keeps the scales, the rest are projected x and y coordinates
+        data = np.load(cache_fname, mmap_mode='r')
+        if data[0, 0] == x_scale and data[1, 0] == y_scale:
+            return Cities(data[0, 1:], data[1, 1:], x_scale, y_scale, projected=True)
+    
+    import pandas as pd
+    
+    data = pd.read_csv(fname, usecols=['lat', 'lng'])
+    cities = Cities(data['lng'].values, data['lat'].values, x_scale, y_scale)
+    if cache:
+        # written to a temporary file first, so other processes never map a half-written cache
+        tmp_fname = None
+        try:
+            fd, tmp_fname = tempfile.mkstemp(suffix='.npy', dir=os.path.dirname(cache_fname) or '.')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.stack([np.r_[x_scale, cities.px], np.r_[y_scale, cities.py]]))
+            os.replace(tmp_fname, cache_fname)
+        except OSError:  # e.g. a read-only data directory, the cities are still usable without a cache
+            if tmp_fname and os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+    return cities
+
+
+def distance_matrix(cities, x_scale=94.05163, y_scale=110.89431):
+    ''' Read-only NumPy matrix of distances between all pairs of cities (same values as `Point2D.distance`).
+        It is built once per list of cities and shared by all tours of those cities.
+    '''
+    if isinstance(cities, Cities):
+        return cities.distance_matrix()
+    
+    coords = ([(c.x, c.y) for c in cities], x_scale, y_scale)
+    if not coords[0]:
+        return _distance_matrix(*coords)
+    
+    # lists cannot be weakly referenced, so the matrix is kept with the first city of the list 
+    # and is freed with the cities (the coordinates tell whether it is still the same list)
+    cached = _distance_matrices.get(cities[0])
+    if cached is None or cached[0] != coords:
+        cached = _distance_matrices[cities[0]] = (coords, _distance_matrix(*coords))
+    return cached[1]
+
+
+_distance_matrices = weakref.WeakKeyDictionary()
+
+
+def _distance_matrix(coords, x_scale, y_scale):
+    import numpy as np
+    
+    xs = np.array([x for x, _ in coords], dtype=float)
+    ys = np.array([y for _, y in coords], dtype=float)
+    dx = (xs[:, None] - xs[None, :]) * x_scale
+    dy = (ys[:, None] - ys[None, :]) * y_scale
+    D = np.sqrt(dx * dx + dy * dy)
+    D.flags.writeable = False
+    return D
+
+
+def _iran_map():
+    ''' Map of Iran on the current figure (Basemap is slow to load)'''
+    from mpl_toolkits.basemap import Basemap
+    
+    m = Basemap(projection='gnom', resolution='l', 
+                lat_0=32.5, lon_0=54,
+                width=1.8E6, height=1.7E6)
+
+    m.drawcoastlines(color='gray')
+    m.drawcountries(color='black')
+    return m
+
+
 def plot_sa_history(history):
+    ''' Plots tour lengths of a history of tours (or of a sequence of lengths)'''
+    import matplotlib.pyplot as plt
+    
     plt.figure(figsize=(8, 4))
-    plt.plot([tour.len for tour in history])
+    plt.plot([getattr(tour, 'len', tour) for tour in history])
     plt.xlabel('Iteration')
     plt.ylabel('Tour length')
     plt.show()
     
 
 def plot_fitness(bests, means=None):
+    import matplotlib.pyplot as plt
+    
     plt.figure(figsize=(8, 4))
     if means:
         plt.plot(means, label='Average')
@@ -44,7 +140,7 @@ class Point2D:
     def distance(self, other, x_scale=94.05163, y_scale=110.89431):
         dx = (self.x - other.x) * x_scale
         dy = (self.y - other.y) * y_scale    
-        return math.sqrt(dx ** 2 + dy ** 2)
+        return math.sqrt(dx * dx + dy * dy)
     
     def __str__(self):
         return "({:.2f}, {:.2f})".format(self.x, self.y)
@@ -53,48 +149,216 @@ class Point2D:
         return str(self)
 
 
+class Cities:
+    ''' A set of cities stored as two contiguous float64 arrays of projected coordinates 
+        (`px = x * x_scale` and `py = y * y_scale`, in km), instead of one `Point2D` per city.
+        
+        It can be used wherever a list of cities is expected: indexing gives a `Point2D` with the 
+        original coordinates (e.g. for plotting) and slicing gives a smaller `Cities`.
+    '''
+    
+    __slots__ = ('px', 'py', 'x_scale', 'y_scale', '_D')
+    
+    def __init__(self, xs, ys, x_scale=94.05163, y_scale=110.89431, projected=False):
+        import numpy as np
+        
+        self.x_scale, self.y_scale = x_scale, y_scale
+        if projected:
+            self.px, self.py = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+        else:
+            self.px = np.asarray(xs, dtype=np.float64) * x_scale
+            self.py = np.asarray(ys, dtype=np.float64) * y_scale
+        self._D = None
+        
+    @staticmethod
+    def from_points(points, x_scale=94.05163, y_scale=110.89431):
+        return Cities([p.x for p in points], [p.y for p in points], x_scale, y_scale)
+    
+    def __len__(self):
+        return len(self.px)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return Cities(self.px[i], self.py[i], self.x_scale, self.y_scale, projected=True)
+        return Point2D(float(self.px[i]) / self.x_scale, float(self.py[i]) / self.y_scale)
+    
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+    
+    def distance(self, i, j):
+        ''' Distance between cities i and j '''
+        dx, dy = self.px[i] - self.px[j], self.py[i] - self.py[j]
+        return math.sqrt(dx * dx + dy * dy)
+    
+    def distance_matrix(self):
+        ''' Read-only matrix of distances between all pairs of cities (built once)'''
+        if self._D is None:
+            import numpy as np
+            
+            dx = self.px[:, None] - self.px[None, :]
+            dy = self.py[:, None] - self.py[None, :]
+            self._D = np.sqrt(dx * dx + dy * dy)
+            self._D.flags.writeable = False
+        return self._D
+    
+    def tour_length(self, ids):
+        ''' Length of the closed tour visiting cities in the order of `ids` (vectorized)'''
+        import numpy as np
+        
+        ids = np.asarray(ids, dtype=np.intp)
+        prev = np.roll(ids, 1)
+        dx, dy = self.px[ids] - self.px[prev], self.py[ids] - self.py[prev]
+        return float(np.sqrt(dx * dx + dy * dy).sum())
+    
+    def spatial_index(self):
+        return KDTree(self.px, self.py, 1.0, 1.0)
+    
+    def __repr__(self):
+        return f'Cities(N={len(self)})'
+    
+    
 class Tour:
     def __init__(self, cities):
         self.N = len(cities)
         self.cities = cities
+        self._D = None  # distance matrix, built on first use and shared by all tours of these cities
         self.ids = list(range(self.N))
         random.shuffle(self.ids)
         self.len = -1
+        self.proposal = None  # move drawn by `propose()`, waiting for `accept()` or `reject()`
+        
+    def copy(self):
+        ''' Cheap copy: cities and distances never change and are shared, only `ids` is copied '''
+        tour = Tour.__new__(Tour)
+        tour.N, tour.cities, tour._D = self.N, self.cities, self._D
+        tour.ids = self.ids.copy()
+        tour.len = self.len
+        tour.proposal = None
+        return tour
+    
+    def __deepcopy__(self, memo):
+        return self.copy()
+        
+    @property
+    def D(self):
+        if self._D is None:
+            self._D = distance_matrix(self.cities)
+        return self._D
         
     def length(self):
         if self.len < 0:
-            self.len = sum([self.cities[self.ids[i-1]].distance(self.cities[self.ids[i]])
-                            for i in range(self.N)])        
+            if self._D is None and isinstance(self.cities, Cities):
+                self.len = self.cities.tour_length(self.ids)
+            elif self._D is None:
+                # large tours do not need the O(N^2) matrix (the distances are the same)
+                self.len = sum([self.cities[self.ids[i-1]].distance(self.cities[self.ids[i]])
+                                for i in range(self.N)])
+            else:
+                import numpy as np
+                
+                ids = np.array(self.ids, dtype=int)
+                self.len = sum(self.D[np.roll(ids, 1), ids].tolist())
             
         return self.len
     
+    def swap_delta(self, i, j):
+        ''' Change in length if cities at positions i and j are swapped (in O(1))'''
+        N, ids, d = self.N, self.ids, self.D.item
+        i, j = min(i, j), max(i, j)
+        
+        if 1 < j - i < N - 1:
+            # the two cities are not adjacent: four edges change
+            a, b = ids[i], ids[j]
+            pa, na, pb, nb = ids[i - 1], ids[i + 1], ids[j - 1], ids[(j + 1) % N]
+            return (d(pa, b) + d(b, na) + d(pb, a) + d(a, nb)
+                    - d(pa, a) - d(a, na) - d(pb, b) - d(b, nb))
+        
+        if i == j: 
+            return 0.0
+        
+        # adjacent cities (or tiny tours): compare the edges around positions i and j
+        def city(k):
+            k %= N
+            return ids[j] if k == i else ids[i] if k == j else ids[k]
+        
+        edges = {(i - 1) % N, i, (j - 1) % N, j}
+        return (sum(d(city(k), city(k + 1)) for k in edges) 
+                - sum(d(ids[k], ids[(k + 1) % N]) for k in edges))
+    
+    def reverse_delta(self, i, j):
+        ''' Change in length if cities at positions i..j are reversed (2-opt move, in O(1))'''
+        N, ids, d = self.N, self.ids, self.D.item
+        i, j = min(i, j), max(i, j)
+        
+        if j - i >= N - 2:
+            return 0.0  # the whole tour (or all but one city): the same cycle
+        
+        a, b, c, e = ids[i - 1], ids[i], ids[j], ids[(j + 1) % N]
+        return d(a, c) + d(b, e) - d(a, b) - d(c, e)
+    
+    def swap(self, i, j, delta=None):
+        ''' Swaps cities at positions i and j in place (the length is updated in O(1))'''
+        if delta is None:
+            delta = self.swap_delta(i, j)
+        self.ids[i], self.ids[j] = self.ids[j], self.ids[i]
+        if self.len >= 0:
+            self.len += delta
+    
+    def reverse(self, i, j, delta=None):
+        ''' Reverses cities at positions i..j in place (the length is updated in O(1))'''
+        if delta is None:
+            delta = self.reverse_delta(i, j)
+        self.ids[i: j + 1] = reversed(self.ids[i: j + 1])
+        if self.len >= 0:
+            self.len += delta
+    
     def random_neighbor(self):
-        neighbor = deepcopy(self)
+        self.length()
+        neighbor = self.copy()
         
         i = random.randint(0, self.N - 2)
         j = random.randint(i + 1, self.N - 1)
         
         c = random.choice([1, 2, 2, 2])
         if c == 1:
-            neighbor.ids[i], neighbor.ids[j] = neighbor.ids[j], neighbor.ids[i]
+            neighbor.swap(i, j)
         elif c == 2:
-            neighbor.ids[i: j + 1] = reversed(neighbor.ids[i: j + 1])
+            neighbor.reverse(i, j)
         else:
             random.shuffle(neighbor.ids[i: j + 1])
+            neighbor.len = -1
             
-        neighbor.len = -1  # neighbor.length()
         return neighbor
     
+    def propose(self):
+        ''' Draws a random move, exactly as `random_neighbor` does, without changing the tour.
+            Returns the change in length; the move is then applied by `accept()` or dropped by `reject()`.
+        '''
+        self.length()
+        
+        i = random.randint(0, self.N - 2)
+        j = random.randint(i + 1, self.N - 1)
+        
+        if random.choice([1, 2, 2, 2]) == 1:
+            self.proposal = (self.swap, i, j, self.swap_delta(i, j))
+        else:
+            self.proposal = (self.reverse, i, j, self.reverse_delta(i, j))
+        return self.proposal[-1]
+    
+    def accept(self):
+        ''' Applies the proposed move in place '''
+        move, i, j, delta = self.proposal
+        move(i, j, delta)
+        self.proposal = None
+        
+    def reject(self):
+        self.proposal = None
+    
     def plot(self, style='bo-', show_length=True):
-        fig = plt.figure(figsize=(6, 6))
+        import matplotlib.pyplot as plt
         
-        # plot map of iran
-        m = Basemap(projection='gnom', resolution='l', 
-                    lat_0=32.5, lon_0=54,
-                    width=1.8E6, height=1.7E6)
-
-        m.drawcoastlines(color='gray')
-        m.drawcountries(color='black')
+        fig = plt.figure(figsize=(6, 6))
+        m = _iran_map()
         
         # plot tour
         start = self.ids[0:1]
@@ -114,16 +378,13 @@ class Tour:
     
     
 def create_animation_plot(history, xlim, ylim, step=10, figsize=(6, 6), dpi=150):
+    import matplotlib.pyplot as plt
+    from matplotlib import animation
+    
     history = history[::step]
     # First set up the figure, the axis, and the plot element we want to animate
     fig = plt.figure(dpi=dpi, figsize=figsize)
-    
-    m = Basemap(projection='gnom', resolution='l', 
-                lat_0=32.5, lon_0=54,
-                width=1.8E6, height=1.7E6)
-
-    m.drawcoastlines(color='gray')
-    m.drawcountries(color='black')
+    m = _iran_map()
     
     minx, miny = m(xlim[0] - 0.5, ylim[0] - 0.5)
     maxx, maxy = m(xlim[1] + 3.0, ylim[1] + 0.5)
@@ -149,4 +410,267 @@ def create_animation_plot(history, xlim, ylim, step=10, figsize=(6, 6), dpi=150)
                                    interval=30, repeat_delay=1000)
     
     anim.save(f'imgs/{history[0].N}-tsp-sa.gif', writer='ffmpeg')
-    return anim
\ No newline at end of file
+    return anim
+
+
+def simulated_annealing(tour, T0=10, alpha=0.999, tol=1e-20, stats=None):
+    ''' Simulated annealing starting from a copy of `tour`. Every random neighbor (a swap or a 
+        reversal, as in `Tour.random_neighbor`) is scored in O(1) by its change in length, and 
+        the tour is only changed when the move is accepted. `stats` (a `utils.Stats`) gets the 
+        counters of the search, and its hooks are called with the current tour and the change 
+        in length of the move.
+        
+        Returns the final tour and the length of the current tour in every iteration.
+    '''
+    current = tour.copy()
+    lengths = [current.length()]
+    T = T0
+    on_expand, on_accept, on_reject = stats_hooks(stats)
+    start_time, accepted = time.perf_counter(), 0
+    
+    try:
+        while T >= tol:
+            if on_expand is not None: on_expand(current)
+        
+            # select a random neighbor of current
+            delta = current.propose()
+        
+            # decide to go from current to neighbor
+            if delta < 0 or random.random() < math.exp(-delta / T):
+                current.accept()
+                accepted += 1
+                if on_accept is not None: on_accept(current, delta)
+            else:
+                current.reject()
+                if on_reject is not None: on_reject(current, delta)
+        
+            # decrease temperature slowly
+            T = alpha * T
+            lengths.append(current.len)
+    finally:  # stats also get the iterations of an interrupted run
+        if stats is not None:
+            iterations = len(lengths) - 1
+            stats.record('search', time.perf_counter() - start_time, iterations=iterations, 
+                         expanded=iterations, accepted=accepted, rejected=iterations - accepted)
+    return current, lengths
+
+
+def spatial_index(cities):
+    ''' KD-tree over a list of `Point2D` or a `Cities` set '''
+    if isinstance(cities, Cities):
+        return cities.spatial_index()
+    return KDTree.from_cities(cities)
+
+
+def nearest_neighbors(cities, k=10, index=None):
+    ''' Candidate lists: for every city, indices of its k nearest cities (nearest first)'''
+    if index is None:
+        index = spatial_index(cities)
+    xs, ys = index.xs, index.ys
+    return [[c for c in index.k_nearest(xs[i], ys[i], k + 1) if c != i][:k] 
+            for i in range(len(cities))]
+
+
+def nearest_neighbor_tour(cities, start=0):
+    ''' Tour built by always going to the nearest unvisited city (O(N log N) with a KD-tree)'''
+    tour = Tour(cities)
+    if not cities:
+        return tour
+    
+    index = spatial_index(cities)
+    xs, ys = index.xs, index.ys
+    city = start
+    tour.ids = [city]
+    index.remove(city)
+    
+    while len(index):
+        city = index.nearest(xs[city], ys[city])
+        tour.ids.append(city)
+        index.remove(city)
+        
+    tour.len = -1
+    return tour
+
+
+def mst(cities):
+    ''' Minimum spanning tree of the cities (Prim's algorithm with a KD-tree), as a dictionary 
+        {city index: [indices of its children]} rooted at city 0.
+    '''
+    tree = {}
+    if not cities:
+        return tree
+    
+    index = spatial_index(cities)
+    xs, ys = index.xs, index.ys
+    
+    def nearest(c):
+        ''' (distance, c, nearest city not in the tree) or None '''
+        u = index.nearest(xs[c], ys[c])
+        return None if u is None else (index.distance(c, u), c, u)
+    
+    tree[0] = []
+    index.remove(0)
+    frontier = [nearest(0)]
+    
+    while len(index):
+        _, parent, child = heapq.heappop(frontier)
+        if child in index:
+            tree[parent].append(child)
+            tree[child] = []
+            index.remove(child)
+            for c in (child, parent):
+                edge = nearest(c)
+                if edge: heapq.heappush(frontier, edge)
+        else:
+            # stale entry: the nearest city of parent was added to the tree by another edge
+            edge = nearest(parent)
+            if edge: heapq.heappush(frontier, edge)
+            
+    return tree
+
+
+def mst_tour(cities):
+    ''' Create a minimum spanning tree and walk it in pre-order '''
+    tree = mst(cities)
+    tour = Tour(cities)
+    tour.ids = []
+    stack = [0] if cities else []
+    while stack:
+        city = stack.pop()
+        tour.ids.append(city)
+        stack += reversed(tree[city])
+    tour.len = -1
+    return tour
+
+
+def improve_tour(tour, k=10, or_opt=True, eps=1e-9):
+    ''' Deterministic local search: 2-opt and Or-opt moves until no move improves the tour.
+    
+        Only moves which create an edge from a city to one of its k nearest cities are tried, and 
+        a queue of "active" cities (don't-look bits) makes sure that a city is only looked at again 
+        when one of its tour edges has changed. Each pass therefore costs about O(N * k) to find 
+        the moves; an Or-opt move is applied as at most three reversals, like 2-opt moves.
+        
+        Returns an improved copy of `tour`.
+    '''
+    tour = tour.copy()
+    N = tour.N
+    if N < 5:
+        return tour
+    
+    ids = tour.ids
+    pos = [0] * N
+    for i, c in enumerate(ids): 
+        pos[c] = i
+    index = spatial_index(tour.cities)
+    neighbors = nearest_neighbors(tour.cities, k, index)
+    
+    # edge lengths come from the coordinates (as in `Point2D.distance`), not from the O(N^2) matrix
+    xs, ys, x_scale, y_scale = index.xs, index.ys, index.x_scale, index.y_scale
+    
+    def d(a, b):
+        dx, dy = (xs[a] - xs[b]) * x_scale, (ys[a] - ys[b]) * y_scale
+        return math.sqrt(dx * dx + dy * dy)
+
+    # don't-look bits: only cities in the queue are looked at
+    queue = deque(ids)
+    active = [True] * N
+    
+    def activate(*cities):
+        for c in cities:
+            if not active[c]:
+                active[c] = True
+                queue.append(c)
+    
+    def succ(c): 
+        return ids[(pos[c] + 1) % N]
+    
+    def pred(c): 
+        return ids[pos[c] - 1]
+
+    def reverse(i, j):
+        ''' Reverses positions i..j of the (cyclic) tour, or the complement if it is shorter'''
+        length = (j - i) % N + 1
+        if 2 * length > N:
+            i, j, length = (j + 1) % N, (i - 1) % N, N - length
+        for _ in range(length // 2):
+            ids[i], ids[j] = ids[j], ids[i]
+            pos[ids[i]], pos[ids[j]] = i, j
+            i, j = (i + 1) % N, (j - 1) % N
+            
+    def two_opt(a):
+        ''' Replaces edges (a, b) and (c, e) by (a, c) and (b, e) '''
+        for forward in (True, False):
+            b = succ(a) if forward else pred(a)
+            d_ab = d(a, b)
+            for c in neighbors[a]:
+                d_ac = d(a, c)
+                if d_ac >= d_ab: 
+                    break
+                e = succ(c) if forward else pred(c)
+                if c == b or e == a: 
+                    continue
+                gain = d_ab + d(c, e) - d_ac - d(b, e)
+                if gain > eps:
+                    if forward: reverse(pos[b], pos[c])
+                    else: reverse(pos[c], pos[b])
+                    activate(a, b, c, e)
+                    return True
+        return False
+    
+    def exchange(a, b, c, e):
+        ''' Replaces edges (a, b) and (c, e) by (a, c) and (b, e), where b follows a and e follows c
+            in the same direction (a 2-opt move)'''
+        if succ(a) == b: reverse(pos[b], pos[c])
+        else: reverse(pos[c], pos[b])
+    
+    def move_segment(a):
+        ''' Moves a segment of 1 to 3 cities starting at a (possibly reversed) next to a neighbor of a'''
+        for L in range(1, min(3, N - 3) + 1):
+            segment = [ids[(pos[a] + t) % N] for t in range(L)]
+            e = segment[-1]
+            p, n = pred(a), succ(e)
+            removed = d(p, a) + d(e, n) - d(p, n)
+            
+            for c in neighbors[a]:
+                d_ac = d(a, c)
+                if d_ac >= removed:
+                    break
+                if c in segment:
+                    continue
+                
+                # neighbors of c once the segment is taken out
+                after = n if c == p else succ(c)
+                before = p if c == n else pred(c)
+                
+                # p, a..e, n, ..., u, v  ->  p, n, ..., u, a..e, v  as 2-opt moves (3 reversals), or
+                #                        ->  p, n, ..., u, e..a, v  (2 reversals, 1 if u is p)
+                if removed - (d_ac + d(e, after) - d(c, after)) > eps:
+                    u, v = c, after
+                    exchange(p, a, e, n)
+                    exchange(p, e, u, v)
+                    exchange(p, u, n, a)
+                elif removed - (d(before, e) + d_ac - d(before, c)) > eps:
+                    u, v = before, c
+                    if u == p:
+                        exchange(p, a, e, n)
+                    else:
+                        exchange(p, a, u, v)
+                        exchange(p, u, n, e)
+                else:
+                    continue
+                    
+                activate(p, n, u, v, *segment)
+                return True
+        return False
+
+    while queue:
+        a = queue.popleft()
+        active[a] = False
+        
+        if two_opt(a) or (or_opt and move_segment(a)):
+            activate(a)
+
+    tour.len = -1
+    tour.length()
+    return tour
@@ -1,8 +1,12 @@
 import math
 import time
+import json
 import heapq, random
+from array import array
+from collections import deque
+from contextlib import contextmanager
 
-import matplotlib.pyplot as plt
+# matplotlib is imported by show_solution when it is called, so the search code never loads it
 
 
 def timed(f, *args, **kwargs):
@@ -26,6 +30,8 @@ def print_solution(start_state, path):
 
 
 def show_solution(start_state, path, ncols=5, fs=18):
+    import matplotlib.pyplot as plt
+    
     if not isinstance(path, list):
         print("No solution found!")
         return
@@ -51,13 +57,36 @@ def show_solution(start_state, path, ncols=5, fs=18):
 
 
 def solution(node):
+    ''' Path of (state, action) from the root to node (in O(depth))'''
     path = []
     while node.parent is not None:
-        path = [(node.state, node.action)] + path
+        path.append((node.state, node.action))
         node = node.parent
+    path.reverse()
     return path
 
 
+class Node:
+    ''' A node of a search tree: a state, the node it was reached from with an action, the cost 
+        of the path from the root (g) and its depth.
+    '''
+    
+    __slots__ = ('state', 'parent', 'action', 'g', 'depth')
+    
+    def __init__(self, state, parent=None, action=None, g=0):
+        self.state, self.parent, self.action, self.g = state, parent, action, g
+        self.depth = 0 if parent is None else parent.depth + 1
+        
+    def __repr__(self):
+        return f'Node(state={self.state!r}, action={self.action!r}, g={self.g}, depth={self.depth})'
+
+
+def state_key(state):
+    ''' A compact hashable key of state for explored sets (`state.key()` if the state has one)'''
+    key = getattr(state, 'key', None)
+    return state if key is None else key()
+
+
 def manhatan_distance(tile, state1, state2):
     i = state1.tiles.index(tile)
     j = state2.tiles.index(tile)
@@ -70,6 +99,162 @@ def manhatan_distance(tile, state1, state2):
     return abs(row_i - row_j) + abs(col_i - col_j)
 
 
+class History:
+    ''' Trajectory of a local search algorithm. What is kept depends on `mode`:
+
+        'full'      every state (needed for step-by-step plots and animations)
+        'objective' only objective values (and temperatures) in compact arrays
+        'every'     objective values and every k-th state
+        'last'      only the last `size` states (ring buffer)
+        'off'       nothing, only the number of iterations is counted
+        None        'full' for verbose searches and 'objective' otherwise
+
+        Iterating over (or indexing) a history gives the kept states.
+    '''
+    
+    MODES = ('full', 'objective', 'every', 'last', 'off')
+    
+    def __init__(self, mode=None, k=100, size=1000):
+        if mode is not None and mode not in History.MODES:
+            raise ValueError(f'Unknown history mode {mode!r}, expected one of {History.MODES}')
+            
+        self.mode, self.k, self.size = mode, k, size
+        self.states = None
+        self.objective = array('d')
+        self.temperature = array('d')
+        self.num_iterations = 0
+        
+    def start(self, verbose=0):
+        ''' Called by a search algorithm before it starts recording '''
+        if self.mode is None:
+            self.mode = 'full' if verbose else 'objective'
+        if self.states is None:
+            self.states = deque(maxlen=self.size) if self.mode == 'last' else []
+            
+    def append(self, state, value, T=None):
+        ''' Records one iteration: the current state, its objective value and temperature'''
+        i = self.num_iterations
+        self.num_iterations += 1
+        
+        mode = self.mode
+        if mode == 'off': 
+            return
+        
+        if mode != 'last':
+            self.objective.append(value)
+            if T is not None: self.temperature.append(T)
+            
+        if state is not None and (mode == 'full' or mode == 'last' or (mode == 'every' and i % self.k == 0)):
+            self.states.append(state)
+    
+    def __len__(self):
+        return len(self.states) if self.states else 0
+    
+    def __iter__(self):
+        return iter(self.states or ())
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self)[i]
+        return self.states[i]
+    
+    def __repr__(self):
+        return f'History(mode={self.mode!r}, iterations={self.num_iterations}, states={len(self)})'
+
+
+class Stats:
+    ''' Statistics of search runs, shared by the search strategies and the local search algorithms.
+        A solver created with `stats=Stats()` adds its counters (e.g. expanded, generated, duplicates,
+        accepted, rejected) and its time per phase after every search; counters named max_... keep
+        their maximum. Without stats (the default) solvers only keep their usual attributes.
+
+        Hooks are called during the search:
+            'expand'  hook(node) for every expanded node (or hook(state) for the current state of a
+                      local search)
+            'accept'  hook(state, delta) for every accepted move, delta is the change of the objective
+            'reject'  hook(state, delta) for every rejected move
+        Solvers fetch the hooks once per search, so events without hooks cost nothing.
+    '''
+
+    EVENTS = ('expand', 'accept', 'reject')
+
+    def __init__(self, hooks=None):
+        self.hooks = {event: [] for event in Stats.EVENTS}
+        for event, hook in (hooks or {}).items():
+            self.on(event, hook)
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.times = {}  # seconds spent in every phase
+        self.runs = 0
+
+    def on(self, event, hook):
+        ''' Calls hook on every event (see the class docstring)'''
+        if event not in Stats.EVENTS:
+            raise ValueError(f'Unknown event {event!r}, expected one of {Stats.EVENTS}')
+        self.hooks[event].append(hook)
+
+    def hook(self, event):
+        ''' A function which calls the hooks of event, or None if it has no hooks '''
+        hooks = self.hooks[event]
+        if len(hooks) <= 1:
+            return hooks[0] if hooks else None
+
+        def call(*args):
+            for hook in hooks:
+                hook(*args)
+        return call
+
+    def record(self, phase=None, seconds=0, **counters):
+        ''' Adds counters (max_... counters keep their maximum) and seconds to the time of phase '''
+        for name, value in counters.items():
+            if name.startswith('max_'):
+                self.counters[name] = max(self.counters.get(name, value), value)
+            else:
+                self.counters[name] = self.counters.get(name, 0) + value
+        if phase is not None:
+            self.times[phase] = self.times.get(phase, 0) + seconds
+            if phase == 'search':
+                self.runs += 1
+
+    @contextmanager
+    def phase(self, name):
+        ''' Adds the time spent in a with block to phase `name` (e.g. building a pattern database)'''
+        start_time = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def snapshot(self):
+        ''' Counters, times and derived rates as a plain dict (JSON serializable)'''
+        counters = self.counters
+        snapshot = {'runs': self.runs, 'counters': dict(counters), 'times': dict(self.times)}
+
+        moves = counters.get('accepted', 0) + counters.get('rejected', 0)
+        if moves:
+            snapshot['acceptance_ratio'] = counters.get('accepted', 0) / moves
+        seconds = self.times.get('search', 0)
+        if seconds > 0:
+            snapshot['rates'] = {f'{name}_per_second': counters[name] / seconds
+                                 for name in ('expanded', 'generated', 'iterations') if name in counters}
+        return snapshot
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def __repr__(self):
+        return f'Stats({self.snapshot()})'
+
+
+def stats_hooks(stats):
+    ''' The expand, accept and reject hooks of stats (None for events without hooks or if stats is None)'''
+    if stats is None:
+        return None, None, None
+    return tuple(stats.hook(event) for event in Stats.EVENTS)
+
+
 """
  Data structures useful for implementing Search Strategies
 """
@@ -88,15 +273,16 @@ class Stack:
     
     def pop(self):
         '''Remove from end'''
-        try:
-            item = self._items.pop()
-            return item
-        except:
-            print('ERROR! trying to pop an element from an empty stack.')
+        if not self._items:
+            raise IndexError('pop from an empty stack')
+        return self._items.pop()
     
     def is_empty(self):
         return len(self._items) == 0
     
+    def __len__(self):
+        return len(self._items)
+    
     def __repr__(self):
         return f'Stack(items={self._items})'
     
@@ -106,7 +292,7 @@ class Stack:
 
 class Queue:
     def __init__(self, items=None):
-        self._items = []
+        self._items = deque()
         
         if items:
             for item in items:
@@ -117,24 +303,24 @@ class Queue:
         self._items.append(item)
     
     def pop(self):
-        '''Remove from front'''
-        try:
-            item = self._items[0]
-            self._items = self._items[1:]
-            return item
-        except:
-            print('ERROR! trying to pop an element from an empty queue.')
+        '''Remove from front (in O(1))'''
+        if not self._items:
+            raise IndexError('pop from an empty queue')
+        return self._items.popleft()
     
     def is_empty(self):
         return len(self._items) == 0
     
+    def __len__(self):
+        return len(self._items)
+    
     def __repr__(self):
-        return f'Queue(items={self._items})'
+        return f'Queue(items={list(self._items)})'
     
     def __str__(self):
         return f"[{', '.join(self._items)}]"
     
-
+    
 class PriorityQueue:
     ''' Min Priority Queue '''
     
@@ -154,15 +340,17 @@ class PriorityQueue:
     
     def pop(self):
         '''Remove the item with highest priority'''
-        try:
-            _, _, item = heapq.heappop(self._items)
-            return item
-        except:
-            print('ERROR! trying to pop an element from an empty priority queue.')
+        if not self._items:
+            raise IndexError('pop from an empty priority queue')
+        _, _, item = heapq.heappop(self._items)
+        return item
     
     def is_empty(self):
         return len(self._items) == 0
     
+    def __len__(self):
+        return len(self._items)
+    
     def __repr__(self):
         return f'PriorityQueue(items={self._items})'
     
@@ -171,4 +359,69 @@ class PriorityQueue:
         for priority, _, item in self._items:
             res += f' {item}({priority}) '
         res += ']'
-        return res
\ No newline at end of file
+        return res
+    
+    
+class IndexedPriorityQueue:
+    ''' Min Priority Queue which keeps at most one item per key (e.g. per state), so it has O(1) 
+        membership test and O(log n) decrease_key. Decreasing the priority of a key pushes a new 
+        entry, and the old one is skipped when it reaches the top (it is no longer the live entry).
+    '''
+    
+    def __init__(self, items=None):
+        self._items = []    # heap of (priority, index, key, item)
+        self._entries = {}  # key -> its live entry in the heap
+        self.index = 0
+        
+        if items:
+            for item, priority in items:
+                self.push(item, priority)
+                
+    def push(self, item, priority, key=None):
+        ''' Adds item with the given key (the item itself by default). If the key is already in 
+            the queue, its item and priority are replaced unless priority is higher (so an equal 
+            priority replaces the item). Returns True if the item was added.
+        '''
+        if key is None:
+            key = item
+            
+        entry = self._entries.get(key)
+        if entry is not None and priority > entry[0]:
+            return False
+            
+        entry = (priority, self.index, key, item)
+        self._entries[key] = entry
+        heapq.heappush(self._items, entry)
+        self.index += 1
+        return True
+    
+    def decrease_key(self, key, priority, item=None):
+        ''' Lowers the priority of key (and replaces its item if given)'''
+        entry = self._entries[key]
+        if priority > entry[0]:
+            raise ValueError(f'New priority {priority} is greater than the current priority {entry[0]}')
+        self.push(entry[3] if item is None else item, priority, key)
+        
+    def priority(self, key):
+        return self._entries[key][0]
+    
+    def pop(self):
+        '''Remove the item with highest priority'''
+        while self._items:
+            entry = heapq.heappop(self._items)
+            if self._entries.get(entry[2]) is entry:
+                del self._entries[entry[2]]
+                return entry[3]
+        raise IndexError('pop from an empty priority queue')
+    
+    def is_empty(self):
+        return len(self._entries) == 0
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, key):
+        return key in self._entries
+    
+    def __repr__(self):
+        return f'IndexedPriorityQueue(items={[(e[3], e[0]) for e in sorted(self._entries.values())]})'